@@ -0,0 +1,37 @@
+"""Build hook compiling bundled styles into a style pack."""
+
+import importlib.util
+import os
+import shutil
+import tempfile
+
+from hatchling.builders.hooks.plugin.interface import BuildHookInterface
+
+
+class StylePackBuildHook(BuildHookInterface):
+    """Adds precompiled style pack to wheels."""
+
+    PLUGIN_NAME = 'custom'
+
+    def initialize(self, version, build_data):
+        # editable installs use YAML style files directly
+        if 'editable' == version:
+            return
+
+        # load module directly to avoid importing the whole package with its
+        # runtime dependencies
+        spec = importlib.util.spec_from_file_location(
+            'hiearch_styles', os.path.join(self.root, 'src', 'hiearch', 'styles.py'))
+        styles = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(styles)
+
+        self.temp_dir = tempfile.mkdtemp()
+        pack_path = os.path.join(self.temp_dir, styles.PACK_NAME)
+        styles.write_pack(
+            pack_path,
+            styles.compile_pack(os.path.join(self.root, 'src', 'hiearch', 'data', 'styles'), self.metadata.version))
+        build_data['force_include'][pack_path] = f'hiearch/data/styles/{styles.PACK_NAME}'
+
+    def finalize(self, version, build_data, artifact_path):
+        if hasattr(self, 'temp_dir'):
+            shutil.rmtree(self.temp_dir)
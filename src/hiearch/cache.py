@@ -0,0 +1,194 @@
+"""Persistent caches of loaded input files and rendered views."""
+
+import hashlib
+import os
+import pickle
+import shutil
+import tempfile
+import threading
+
+from . import util
+
+
+def get_default_cache_dir():
+    """Get default cache directory: `$XDG_CACHE_HOME/hiearch` or `~/.cache/hiearch`."""
+    cache_home = os.environ.get('XDG_CACHE_HOME')
+    if not cache_home:
+        cache_home = os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(cache_home, 'hiearch')
+
+
+class FileCache:
+    """Directory of cache entries, which are evicted in least recently used
+    order when total size of the cache exceeds the given limit.
+
+    Caches may be shared by threads, the lock is not pickled when the cache is
+    passed to other processes, which track the total size separately.
+    """
+
+    suffix = ''
+
+    def __init__(self, cache_dir, max_size):
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        self.version = util.get_version()
+        # total size of entries is tracked after the first scan, which is
+        # repeated only when the size limit may be exceeded
+        self.total_size = None
+        self.lock = threading.Lock()
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.lock = threading.Lock()
+
+    def _get_path(self, key):
+        return os.path.join(self.cache_dir, key + self.suffix)
+
+    def _touch(self, path):
+        # update access time for LRU eviction
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+
+    def _store(self, key, write):
+        # write to a temporary file first to avoid partially written entries
+        # when the cache is shared by concurrent processes
+        descriptor, temp_path = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+        try:
+            with os.fdopen(descriptor, 'wb') as file:
+                write(file)
+                size = file.tell()
+            os.replace(temp_path, self._get_path(key))
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+
+        with self.lock:
+            if self.total_size is None or self.total_size + size > self.max_size:
+                self.evict()
+            else:
+                # replaced entries are counted twice, which only triggers an earlier scan
+                self.total_size += size
+
+    def evict(self):
+        """Remove least recently used entries until the cache fits the size
+        limit, must be called with the lock held."""
+        entries = []
+        total_size = 0
+        with os.scandir(self.cache_dir) as iterator:
+            for entry in iterator:
+                if not entry.name.endswith(self.suffix):
+                    continue
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+                total_size += stat.st_size
+
+        entries.sort()
+        for _, size, path in entries:
+            if total_size <= self.max_size:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total_size -= size
+        self.total_size = total_size
+
+
+class InputCache(FileCache):
+    """Cache of input data loaded from YAML or DOT files.
+
+    Entries are keyed by file content hash and hiearch version and stored in
+    pickle format.
+    """
+
+    suffix = '.pickle'
+
+    def get_key(self, file_id, content):
+        """Compute cache key of a file, file id is a part of the key since it affects conversion of DOT files."""
+        hasher = hashlib.sha256()
+        for item in [self.version, file_id]:
+            hasher.update(item.encode())
+            hasher.update(b'\0')
+        hasher.update(content)
+        return hasher.hexdigest()
+
+    def load(self, key):
+        """Load cached data, returns None on cache miss."""
+        path = self._get_path(key)
+        try:
+            with open(path, 'rb') as file:
+                data = pickle.load(file)
+        except (OSError, EOFError, ValueError, pickle.UnpicklingError):
+            return None
+
+        self._touch(path)
+        return data
+
+    def store(self, key, data):
+        self._store(key, lambda file: pickle.dump(data, file, protocol=pickle.HIGHEST_PROTOCOL))
+
+
+class RenderCache(FileCache):
+    """Cache of rendered views, which can be shared by multiple projects.
+
+    Entries are keyed by hash of DOT output, contents of resources referenced
+    by the view, output format, and graphviz version.
+    """
+
+    suffix = '.render'
+
+    def __init__(self, cache_dir, max_size):
+        super().__init__(cache_dir, max_size)
+        self.resource_hashes = {}
+
+    def _get_resource_hash(self, resource_path):
+        with self.lock:
+            resource_hash = self.resource_hashes.get(resource_path)
+        if resource_hash is None:
+            # hashing is not locked, the same resource may be hashed by
+            # several threads with identical results
+            with open(resource_path, 'rb') as file:
+                resource_hash = hashlib.sha256(file.read()).hexdigest()
+            with self.lock:
+                self.resource_hashes[resource_path] = resource_hash
+        return resource_hash
+
+    def get_key(self, dot_hash, resources, resource_dir, fmt, graphviz_version):
+        hasher = hashlib.sha256()
+        for item in [self.version, fmt, graphviz_version, dot_hash]:
+            hasher.update(item.encode())
+            hasher.update(b'\0')
+        for resource in sorted(resources):
+            for item in [resource, self._get_resource_hash(os.path.join(resource_dir, resource))]:
+                hasher.update(item.encode())
+                hasher.update(b'\0')
+        return hasher.hexdigest()
+
+    def fetch(self, key, output_path):
+        """Copy cached rendering to the output path, returns False on cache miss."""
+        path = self._get_path(key)
+        try:
+            shutil.copyfile(path, output_path)
+        except FileNotFoundError:
+            return False
+
+        self._touch(path)
+        return True
+
+    def store(self, key, output_path):
+        def write(file):
+            with open(output_path, 'rb') as output_file:
+                shutil.copyfileobj(output_file, file)
+        self._store(key, write)
@@ -0,0 +1,128 @@
+"""Streaming writer of graphviz DOT files.
+
+Quoting follows pydot, which was used for DOT generation previously, so that
+generated files stay unchanged. Unlike pydot, identifiers are never split
+into node and port parts since hiearch does not use ports.
+"""
+
+import hashlib
+import re
+
+
+_DOT_KEYWORDS = ('graph', 'subgraph', 'digraph', 'node', 'edge', 'strict')
+_DEFAULTS_KEYWORDS = ('graph', 'node', 'edge')
+
+_NUMERIC_PATTERN = re.compile(r'^([0-9]+\.?[0-9]*|[0-9]*\.[0-9]+)$')
+_QUOTED_PATTERN = re.compile(r'^".*"$', re.S)
+_HTML_PATTERN = re.compile(r'^<.*>$', re.S)
+_ID_PATTERN = re.compile(r'^[_a-zA-Z][a-zA-Z0-9_]*$')
+
+
+def _quote(value):
+    value = value.replace('"', r'\"').replace('\n', r'\n').replace('\r', r'\r')
+    return f'"{value}"'
+
+
+def _any_needs_quotes(value):
+    """Common quoting rules of ids and attribute values, returns None if undecided."""
+    if value.isdigit():
+        return False
+    if value.isalnum():
+        return value[0].isdigit()
+
+    has_high_chars = any(ord(char) > 0x7F or ord(char) == 0 for char in value)
+    if has_high_chars and not _QUOTED_PATTERN.match(value) and not _HTML_PATTERN.match(value):
+        return True
+
+    for pattern in (_NUMERIC_PATTERN, _QUOTED_PATTERN, _HTML_PATTERN):
+        if pattern.match(value):
+            return False
+
+    return None
+
+
+def format_id(value, unquoted_keywords=()):
+    if isinstance(value, bool):
+        return str(value).lower()
+    if not isinstance(value, str) or not value:
+        return value
+    if value.lower() in _DOT_KEYWORDS:
+        return value if value.lower() in unquoted_keywords else _quote(value)
+
+    needs_quotes = _any_needs_quotes(value)
+    if needs_quotes is None:
+        needs_quotes = _ID_PATTERN.match(value) is None
+    return _quote(value) if needs_quotes else value
+
+
+def format_value(value):
+    if isinstance(value, bool):
+        return str(value).lower()
+    if not isinstance(value, str):
+        return value
+    if value.lower() in _DOT_KEYWORDS:
+        return _quote(value)
+    if _any_needs_quotes(value) is False:
+        return value
+    return _quote(value)
+
+
+def format_attribute(key, value):
+    if '' == value:
+        return f'{key}=""'
+    if value is None:
+        return key
+    return f'{key}={format_value(value)}'
+
+
+def format_attributes(attrs):
+    if not attrs:
+        return ''
+    return ' [' + ', '.join(format_attribute(key, value) for key, value in attrs.items()) + ']'
+
+
+class DotWriter:
+    """Writes DOT statements to a text file as they are generated and
+    computes hash of the written text on the fly.
+
+    Statements must be written in the same order as they are expected in the
+    output: graph attributes, node and edge defaults, nodes and subgraphs,
+    and edges.
+    """
+
+    def __init__(self, file):
+        self.file = file
+        self.hasher = hashlib.sha256()
+
+    def _write(self, text):
+        self.file.write(text)
+        self.hasher.update(text.encode('utf-8'))
+
+    def _begin(self, keyword, name, attrs):
+        self._write(f'{keyword} {format_id(name)} {{\n')
+        for key, value in attrs.items():
+            self._write(f'{format_attribute(key, value)};\n')
+
+    def begin_digraph(self, name, attrs):
+        self._begin('digraph', name, attrs)
+
+    def begin_subgraph(self, name, attrs):
+        self._begin('subgraph', name, attrs)
+
+    def end(self):
+        self._write('}\n')
+
+    def defaults(self, kind, attrs):
+        # empty defaults produce an empty line for compatibility with pydot
+        if attrs:
+            self._write(f'{kind}{format_attributes(attrs)};')
+        self._write('\n')
+
+    def node(self, name, attrs):
+        self._write(f'{format_id(name, _DEFAULTS_KEYWORDS)}{format_attributes(attrs)};\n')
+
+    def edge(self, tail, head, attrs):
+        self._write(f'{format_id(tail)} -> {format_id(head)}{format_attributes(attrs)};\n')
+
+    def hexdigest(self):
+        return self.hasher.hexdigest()
@@ -1,8 +1,6 @@
 #!/usr/bin/env python3
 """Converter module for converting DOT files to hiearch YAML representation."""
 
-import pydot
-
 
 def _extract_default_attributes(defaults_list):
     """Generic function to extract default attributes from a list of default objects."""
@@ -129,6 +127,9 @@ def dot_to_hiearch(file_id, dot_content):
     Returns:
         Dictionary representing hiearch data structure
     """
+    # pydot is slow to import and is needed only for DOT inputs
+    import pydot
+
     graphs = pydot.graph_from_dot_data(dot_content)
 
     if not graphs:
@@ -1,18 +1,22 @@
-"""Module for generating graphviz diagrams using pydot."""
+"""Module for generating graphviz diagrams."""
 
+import bisect
+import concurrent.futures
 import copy
+import io
+import json
 import os
 import subprocess
 
-import pydot
-
+from . import dot_writer
 from . import hh_node
+from . import output
 from . import util
 
 
 def get_attributes(node, extended_attrs, label_format_key):
     attrs = dict(extended_attrs)
-    attrs.update(copy.deepcopy(node['graphviz']))
+    attrs.update(copy.deepcopy(node.graphviz))
 
     substitutions = hh_node.get_substitutions(node)
     if extended_attrs['expanded_from'] is not None:
@@ -28,9 +32,9 @@ def get_attributes(node, extended_attrs, label_format_key):
         attrs.pop(attr, None)
 
     util.process_auto_colors(attrs, [
-        node['id'],
-        node['style'],
-        node['label']
+        node.id,
+        node.style,
+        node.label
     ])
 
     return attrs
@@ -42,17 +46,19 @@ def get_scope_attributes(node, extended_attrs):
     return attrs
 
 
-def get_edge_attributes(edge):
-    attrs = copy.deepcopy(edge['graphviz'])
+def get_edge_attributes(edge, scope_attrs=None):
+    attrs = copy.deepcopy(edge.graphviz)
+    if scope_attrs is not None:
+        attrs.update(scope_attrs)
 
-    for attr, label, fmt in zip(['taillabel', 'label', 'headlabel'], edge['label'], attrs['label_format']):
-        substitutions = dict(edge['substitutions'])
+    for attr, label, fmt in zip(['taillabel', 'label', 'headlabel'], edge.label, attrs['label_format']):
+        substitutions = dict(edge.substitutions)
         substitutions.update({
             'label': label,
-            'id': edge['id'],
-            'node_in': edge['in'],
-            'node_out': edge['out'],
-            'style': edge['style']
+            'id': edge.id,
+            'node_in': edge.in_,
+            'node_out': edge.out,
+            'style': edge.style
         })
 
         formatted_label = fmt.format(**substitutions)
@@ -63,45 +69,185 @@ def get_edge_attributes(edge):
         attrs.pop('label_format')
 
     util.process_auto_colors(attrs, [
-        edge['orig_in'],
-        edge['orig_out'],
-        edge['style'],
-        edge['label']
+        edge.orig_in,
+        edge.orig_out,
+        edge.style,
+        edge.label
     ])
 
     return attrs
 
 
-def generate_tree(graph, tree, nodes, extended_attrs):
+def generate_tree(writer, tree, nodes, extended_attrs):
     if len(tree) > 0:
         for node_key, node_tuple in tree.items():
             node = nodes[node_key]
 
             if 0 == len(node_tuple['subtree']):
-                graph.add_node(
-                        pydot.Node(node_tuple['key_path'],
-                                   **get_attributes(node, extended_attrs, 'node_label_format')))
+                writer.node(node_tuple['key_path'], get_attributes(node, extended_attrs, 'node_label_format'))
             else:
-                subgraph = pydot.Subgraph(
-                        graph_name=node_tuple['key_path'],
-                        **get_scope_attributes(node, extended_attrs))
-                generate_tree(subgraph, node_tuple['subtree'], nodes, extended_attrs)
-                graph.add_subgraph(subgraph)
+                writer.begin_subgraph(node_tuple['key_path'], get_scope_attributes(node, extended_attrs))
+                generate_tree(writer, node_tuple['subtree'], nodes, extended_attrs)
+                writer.end()
 
 
 class OutputConfig:
-    def __init__(self, output_dir, temp_dir, fmt):
+    def __init__(self, output_dir, temp_dir, fmt, incremental=False, render_cache=None, keep_dot=False):
         self.output_dir = output_dir
         self.temp_dir = temp_dir
-        self.fmt = fmt
-
-
-def generate(output_config, view, nodes, copied_resources=None):
+        self.keep_dot = keep_dot
+        # multiple comma separated formats are produced from a single layout
+        self.formats = [single_fmt.strip() for single_fmt in fmt.split(',') if single_fmt.strip()]
+        self.incremental = incremental
+        self.render_cache = render_cache
+
+        extensions = [get_extension(single_fmt) for single_fmt in self.formats]
+        if len(set(extensions)) != len(extensions):
+            raise RuntimeError(f'Output formats must have different file extensions: {self.formats}')
+
+
+class RenderTask:
+    """View with generated DOT text that is ready for rendering."""
+
+    def __init__(self, view, dot_text, dot_hash, resources=None):
+        self.view_id = view['id']
+        self.size = len(view['nodes']) + len(view['edges']) + len(view['custom_edges'])
+        self.dot_text = dot_text
+        self.dot_hash = dot_hash
+        self.resources = resources if resources is not None else set()
+
+
+def get_graphviz_version():
+    result = subprocess.run(['dot', '-V'], check=True, capture_output=True)
+    return result.stderr.decode('utf-8', errors='replace').strip()
+
+
+class RenderManifest:
+    """Manifest of rendered views, which is used to skip rendering of views
+    with unchanged DOT output.
+
+    Manifest is stored in the output directory and is discarded if output
+    format or graphviz version change.
+    """
+
+    filename = '.hiearch_manifest.json'
+
+    def __init__(self, output_config, graphviz_version):
+        self.path = os.path.join(output_config.output_dir, self.filename)
+        self.formats = output_config.formats
+        self.graphviz_version = graphviz_version
+        self.views = {}
+
+        try:
+            with open(self.path, encoding='utf-8') as file:
+                manifest = json.load(file)
+        except (OSError, ValueError):
+            return
+
+        if manifest.get('formats') == self.formats and manifest.get('graphviz') == self.graphviz_version:
+            self.views = manifest.get('views', {})
+
+    def is_up_to_date(self, view_id, dot_hash, output_paths):
+        return self.views.get(view_id) == dot_hash and all(os.path.exists(path) for path in output_paths)
+
+    def save(self, views):
+        self.views = views
+        with open(self.path, 'w', encoding='utf-8') as file:
+            json.dump({
+                'formats': self.formats,
+                'graphviz': self.graphviz_version,
+                'views': dict(sorted(self.views.items())),
+            }, file, indent=4)
+
+
+def _get_common_prefix_length(first, second):
+    return len(os.path.commonprefix([first, second]))
+
+
+class KeyPaths:
+    """Key paths of nodes in a view and representative leaves of scopes,
+    which are used to connect edges to scopes, computed on demand once per
+    view.
+    """
+
+    def __init__(self, view):
+        self.scopes = view.scopes
+        self.node_key_paths = view.node_key_paths
+        self.sorted_key_paths = {}
+        self.leaves = {}
+
+    def get_key_paths(self, node_key):
+        if node_key not in self.sorted_key_paths:
+            self.sorted_key_paths[node_key] = sorted(self.node_key_paths[node_key])
+        return self.sorted_key_paths[node_key]
+
+    def get_scope_key_path(self, node_key):
+        return self.get_key_paths(node_key)[0]
+
+    def get_leaf(self, node_key):
+        """Get leaf, which represents a scope: first child is followed at each level."""
+        path = []
+        while node_key in self.scopes and node_key not in self.leaves:
+            path.append(node_key)
+            node_key = min(self.scopes[node_key])
+        leaf = self.leaves.get(node_key, node_key)
+        for scope in path:
+            self.leaves[scope] = leaf
+        return leaf
+
+    def select(self, tail_key, head_key):
+        """Select key paths of tail and head with the longest common prefix,
+        i.e., the closest in the tree, ties are resolved in sorted order.
+
+        The longest common prefix of a tail path is found with one of its
+        neighbours among sorted head paths.
+        """
+        tail_paths = self.get_key_paths(tail_key)
+        head_paths = self.get_key_paths(head_key)
+
+        tail = None
+        best_match = -1
+        for tail_candidate in tail_paths:
+            index = bisect.bisect_left(head_paths, tail_candidate)
+            for head_candidate in head_paths[max(index - 1, 0):index + 1]:
+                current_match = _get_common_prefix_length(tail_candidate, head_candidate)
+                if current_match > best_match:
+                    tail = tail_candidate
+                    best_match = current_match
+
+        # first head path sharing the prefix with the tail path
+        head = head_paths[bisect.bisect_left(head_paths, tail[:best_match])]
+        return tail, head
+
+
+def write_edge(writer, key_paths, edge):
+    # adjust edges that connect scopes: pick one non-scope child as the edge start/end
+    # edge attributes may be shared with other edges and views, so they are not modified
+    scope_attrs = {}
+
+    edge_out = key_paths.get_leaf(edge.out)
+    if edge.out != edge_out:
+        scope_attrs['ltail'] = key_paths.get_scope_key_path(edge.out)
+        scope_attrs['tailclip'] = 'false'  # workaround for bad angle of the arrow head
+
+    edge_in = key_paths.get_leaf(edge.in_)
+    if edge.in_ != edge_in:
+        scope_attrs['lhead'] = key_paths.get_scope_key_path(edge.in_)
+        scope_attrs['headclip'] = 'false'  # workaround for bad angle of the arrow head
+
+    tail, head = key_paths.select(edge_out, edge_in)
+    writer.edge(tail, head, get_edge_attributes(edge, scope_attrs))
+
+
+def write_dot(output_config, view, nodes, resource_store=None):
+    """Generate DOT text of a view, which is also written to the temporary
+    directory if requested.
+
+    Returns:
+        Tuple of DOT text and its hash
+    """
     output_dir = output_config.output_dir
     temp_dir = output_config.temp_dir
-    fmt = output_config.fmt
-
-    graph = pydot.Dot(graph_name=view['id'], graph_type='digraph')
 
     extended_attrs = {
         'node_label_format': '{label}',
@@ -109,73 +255,131 @@ def generate(output_config, view, nodes, copied_resources=None):
         'expanded_from': view['expanded_from'],
     }
 
-    if 'graph' in view['graphviz']:
-        for key, value in view['graphviz']['graph'].items():
-            graph.set(key, value)
+    graph_attrs = dict(view['graphviz'].get('graph', {}))
+    graph_attrs['compound'] = 'true'
+
+    # DOT is kept in memory and piped to graphviz, files are written only on request
+    writer = dot_writer.DotWriter(io.StringIO())
+    writer.begin_digraph(view['id'], graph_attrs)
+
     if 'node' in view['graphviz']:
+        # view attributes may be shared with other views, so they are not modified
+        node_attrs = dict(view['graphviz']['node'])
         for key, value in extended_attrs.items():
-            extended_attrs[key] = view['graphviz']['node'].pop(key, value)
-        graph.set_node_defaults(**view['graphviz']['node'])
+            extended_attrs[key] = node_attrs.pop(key, value)
+        writer.defaults('node', node_attrs)
     if 'edge' in view['graphviz']:
-        graph.set_edge_defaults(**view['graphviz']['edge'])
-
-    graph.set('compound', 'true')
-
-    generate_tree(graph, view['tree'], nodes, extended_attrs)
-
-    for edge_set in ['edges', 'custom_edges']:
-        for edge in view[edge_set].values():
-            # adjust edges that connect scopes: pick one non-scope child as the edge start/end
-            # perform sorting of scoped nodes to avoid random placing
-            edge_out = edge['out']
-            while edge_out in view['scopes']:
-                sorted_childs = list(view['scopes'][edge_out])
-                sorted_childs.sort()
-                edge_out = sorted_childs[0]
-            if edge['out'] != edge_out:
-                edge['graphviz']['ltail'] = min(view['node_key_paths'][edge['out']])
-                edge['graphviz']['tailclip'] = 'false'  # workaround for bad angle of the arrow head
-
-            edge_in = edge['in']
-            while edge_in in view['scopes']:
-                sorted_childs = list(view['scopes'][edge_in])
-                sorted_childs.sort()
-                edge_in = sorted_childs[0]
-            if edge['in'] != edge_in:
-                edge['graphviz']['lhead'] = min(view['node_key_paths'][edge['in']])
-                edge['graphviz']['headclip'] = 'false'  # workaround for bad angle of the arrow head
-
-
-            tail = ''
-            head = ''
-            best_match = -1
-
-            for tail_candidate in view['node_key_paths'][edge_out]:
-                for head_candidate in view['node_key_paths'][edge_in]:
-                    current_match = len(os.path.commonprefix([tail_candidate, head_candidate]))
-                    if current_match > best_match:
-                        tail = tail_candidate
-                        head = head_candidate
-                        best_match = current_match
-
-            graph.add_edge(pydot.Edge(tail, head, **get_edge_attributes(edge)))
-
-    # Write the DOT file to the temporary directory
-    dot_file_path = f'{temp_dir}/{view["id"]}.gv'
-    graph.write(dot_file_path)
+        writer.defaults('edge', view['graphviz']['edge'])
+
+    generate_tree(writer, view['tree'], nodes, extended_attrs)
+
+    # edges are sorted to make output independent of set ordering
+    key_paths = KeyPaths(view)
+    for edge_set in [view.edges, view.custom_edges]:
+        for _, edge in sorted(edge_set.items()):
+            write_edge(writer, key_paths, edge)
+
+    writer.end()
+
+    dot_text = writer.file.getvalue()
+    if output_config.keep_dot:
+        with open(f'{temp_dir}/{view["id"]}.gv', 'w', encoding='utf-8') as file:
+            file.write(dot_text)
 
     # Copy resources to output directory for SVG format if output dir differs from temp dir
     # svg:cairo embeds graphics instead of linking, so copy is not necessary
-    if fmt.startswith("svg") and fmt != "svg:cairo":
-        if os.path.realpath(output_dir) != os.path.realpath(temp_dir):
-            for resource in copied_resources:
-                util.copy_resource(os.path.join(temp_dir, resource), output_dir)
-        for resource in copied_resources:
-            print(f'Copied resource: "{resource}"')
+    # resources shared by views are copied only once
+    if any(fmt.startswith("svg") and fmt != "svg:cairo" for fmt in output_config.formats):
+        if resource_store is not None and os.path.realpath(output_dir) != os.path.realpath(temp_dir):
+            for resource in sorted(output.get_resources(view['nodes'], nodes)):
+                if resource_store.stage(resource, output_dir):
+                    print(f'Copied resource: "{resource}"')
+
+    return dot_text, writer.hexdigest()
+
+
+def get_extension(fmt):
+    return fmt.split(":")[0].split("_")[0]
 
-    # Call dot directly (pydot uses temporary dirs that dont play nice with inclusions)
-    abs_output_file_path = os.path.abspath(f'{output_dir}/{view["id"]}.{fmt.split(":")[0].split("_")[0]}')
 
-    cmd = ['dot', '-T' + fmt, '-o', abs_output_file_path, f'{view["id"]}.gv']
-    subprocess.run(cmd, check=True, capture_output=True, cwd=temp_dir)
+def get_output_path(output_config, view_id, fmt):
+    return os.path.abspath(f'{output_config.output_dir}/{view_id}.{get_extension(fmt)}')
 
+
+def render(output_config, view_id, dot_text):
+    # Call dot directly with DOT text on stdin, temporary directory is used as
+    # working directory to resolve relative paths of resources, all formats
+    # are produced from a single layout
+    cmd = ['dot']
+    for fmt in output_config.formats:
+        cmd.extend(['-T' + fmt, '-o', get_output_path(output_config, view_id, fmt)])
+    subprocess.run(cmd, input=dot_text.encode('utf-8'), check=True, capture_output=True, cwd=output_config.temp_dir)
+
+
+def _render_task(output_config, task, graphviz_version):
+    """Render a view or fetch it from the render cache, returns True if the cache was used."""
+    render_cache = output_config.render_cache
+
+    if render_cache is not None:
+        keys = {
+            fmt: render_cache.get_key(task.dot_hash, task.resources, output_config.temp_dir, fmt, graphviz_version)
+            for fmt in output_config.formats
+        }
+        if all(render_cache.fetch(keys[fmt], get_output_path(output_config, task.view_id, fmt)) for fmt in keys):
+            return True
+
+    render(output_config, task.view_id, task.dot_text)
+
+    if render_cache is not None:
+        for fmt, key in keys.items():
+            render_cache.store(key, get_output_path(output_config, task.view_id, fmt))
+    return False
+
+
+def render_views(output_config, tasks, jobs=1):
+    """Render views with up to `jobs` concurrent graphviz processes.
+
+    Biggest views are started first since their layout takes most of the
+    time. Failure of a view does not prevent rendering of other views. Views
+    that have not changed since the previous run are skipped in incremental
+    mode, views found in the render cache are copied from there.
+
+    Returns:
+        Dictionary mapping ids of failed views to error messages
+    """
+    graphviz_version = None
+    if output_config.incremental or output_config.render_cache is not None:
+        graphviz_version = get_graphviz_version()
+
+    manifest = None
+    if output_config.incremental:
+        manifest = RenderManifest(output_config, graphviz_version)
+        outdated_tasks = []
+        for task in tasks:
+            output_paths = [get_output_path(output_config, task.view_id, fmt) for fmt in output_config.formats]
+            if manifest.is_up_to_date(task.view_id, task.dot_hash, output_paths):
+                print(f'Skipped unchanged view: "{task.view_id}"')
+            else:
+                outdated_tasks.append(task)
+    else:
+        outdated_tasks = tasks
+
+    failures = {}
+    with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as executor:
+        futures = {}
+        for task in sorted(outdated_tasks, key=lambda task: task.size, reverse=True):
+            futures[executor.submit(_render_task, output_config, task, graphviz_version)] = task.view_id
+
+        for future in concurrent.futures.as_completed(futures):
+            try:
+                if future.result():
+                    print(f'Copied cached view: "{futures[future]}"')
+            except subprocess.CalledProcessError as error:
+                failures[futures[future]] = error.stderr.decode('utf-8', errors='replace').strip()
+            except OSError as error:
+                failures[futures[future]] = str(error)
+
+    if manifest is not None:
+        manifest.save({task.view_id: task.dot_hash for task in tasks if task.view_id not in failures})
+
+    return failures
@@ -19,6 +19,13 @@ default = {
 }
 
 
+class Edge(util.Entity):
+    """Edge entity, keys are the same as in `default`."""
+
+    __slots__ = ('id', 'link', 'label', 'style', 'style_notag', 'graphviz', 'tags', 'substitutions',
+                 'orig_in', 'orig_out', 'in_', 'out')
+
+
 def generate_id(edge):
     edge['id'] = f'{edge["out"]}.{edge["in"]}'
 
@@ -65,36 +72,35 @@ def parse(yaml_edges, edges, must_exist_nodes):
             edges.styled.append(edge)
             edges.entities[key] = edge
         else:
-            edges.entities[key] = util.merge_styles(default, edge)
+            edges.entities[key] = Edge(util.merge_styles(default, edge))
 
 
-def postprocess(edges):
+def postprocess(edges, style_ancestors=None):
+    """Post-process edges after parsing.
+
+    Returns:
+        Dictionary mapping ids of edges with `hh:style:` tags to their style ancestors
+    """
     util.check_key_existence(edges.must_exist, edges.entities, 'edge')
-    util.apply_styles(edges.styled, edges.entities)
-
-
-    for edge in edges.entities.values():
-        if not isinstance(edge['tags'], set):
-            edge['tags'] = util.ensure_set(edge['tags'])
-        if isinstance(edge['label'], str):
-            edge['label'] = ['', edge['label'], '']
-        if 'label_format' in edge['graphviz']:
-            if isinstance(edge['graphviz']['label_format'], str):
-                edge['graphviz']['label_format'] = ['{label}', edge['graphviz']['label_format'], '{label}']
-            if len(edge['label']) == 0:
-                edge['label'] = ['', '', '']
+    ancestors = util.apply_styles(edges.styled, edges.entities, known_ancestors=style_ancestors, entity_type=Edge)
+
+    style_tags = {}
+
+    # all edges are slotted entities at this point
+    for key, edge in edges.entities.items():
+        if not isinstance(edge.tags, set):
+            edge.tags = util.ensure_set(edge.tags)
+        if isinstance(edge.label, str):
+            edge.label = ['', edge.label, '']
+        if 'label_format' in edge.graphviz:
+            if isinstance(edge.graphviz['label_format'], str):
+                edge.graphviz['label_format'] = ['{label}', edge.graphviz['label_format'], '{label}']
+            if len(edge.label) == 0:
+                edge.label = ['', '', '']
         else:
-            edge['graphviz']['label_format'] = ['{label}', '{label}', '{label}']
+            edge.graphviz['label_format'] = ['{label}', '{label}', '{label}']
 
         if edge.get('style') is not None and edge.get('style_notag') is None:
-            for ancestor in util.collect_style_ancestors(
-                    edge['style'], edges.entities):
-                edge['tags'].add(f'hh:style:{ancestor}')
-
+            style_tags[key] = ancestors[key]
 
-def get_edges_by_tags(edges, tags):
-    selection = {}
-    for key, edge in edges.items():
-        if tags.intersection(edge['tags']):
-            selection[key] = edge
-    return selection
+    return style_tags
@@ -0,0 +1,599 @@
+"""Integer index of nodes and edges used by view algorithms."""
+
+from array import array
+from collections import defaultdict
+
+from . import tag_query
+
+
+SCOPE_TAG_PREFIX = 'hh:scope:'
+STYLE_TAG_PREFIX = 'hh:style:'
+
+
+def _get_postings(entities, keys):
+    """Get mapping of tags to indices of tagged entities."""
+    postings = defaultdict(lambda: array('i'))
+    for index, key in enumerate(keys):
+        for tag in entities[key].tags:
+            postings[tag].append(index)
+    return dict(postings)
+
+
+def _group_by_styles(style_tags, index):
+    """Group entity indices by their style ancestors, which are shared by
+    entities with the same style."""
+    groups = defaultdict(list)
+    if style_tags is not None:
+        for key, ancestors in style_tags.items():
+            groups[ancestors].append(index[key])
+    return dict(groups)
+
+
+def _get_styled(style_groups, style):
+    indices = []
+    for ancestors, group in style_groups.items():
+        if style in ancestors:
+            indices.extend(group)
+    return indices
+
+
+def _to_bits(indices, size):
+    """Convert indices to a bitset stored in an integer."""
+    data = bytearray((size + 7) // 8)
+    for index in indices:
+        data[index >> 3] |= 1 << (index & 7)
+    return int.from_bytes(data, 'little')
+
+
+def _from_bits(bits):
+    """Get indices of set bits."""
+    data = bits.to_bytes((bits.bit_length() + 7) // 8, 'little')
+    for byte_index, byte in enumerate(data):
+        while byte:
+            lowest = byte & -byte
+            yield byte_index * 8 + lowest.bit_length() - 1
+            byte ^= lowest
+
+
+class Adjacency:
+    """Sorted adjacency lists stored in compressed sparse row format."""
+
+    __slots__ = ('offsets', 'targets')
+
+    def __init__(self, size, pairs):
+        lists = [[] for _ in range(size)]
+        for source, target in pairs:
+            lists[source].append(target)
+
+        self.offsets = array('i', [0])
+        self.targets = array('i')
+        for targets in lists:
+            targets.sort()
+            self.targets.extend(targets)
+            self.offsets.append(len(self.targets))
+
+    def __getitem__(self, index):
+        return self.targets[self.offsets[index]:self.offsets[index + 1]]
+
+
+class ScopeIndex:
+    """Index of the scope hierarchy for queries on ancestors and descendants.
+
+    Nodes are ordered topologically with scopes preceding their members, and
+    numbered in depth-first order over the forest of scopes, so that every
+    node is assigned an interval containing nodes first visited through it.
+    For nodes with a single path to the root of the hierarchy, ancestor
+    queries reduce to interval checks, sets of ancestors of other nodes are
+    memoized.
+    Descendants of scopes that are not reachable through other paths are
+    contiguous intervals.
+
+    Queries on nodes involved in scope cycles fall back to traversal, cycles
+    are reported by the tree builder.
+    """
+
+    def __init__(self, graph):
+        self.graph = graph
+        self.size = graph.num_nodes
+        size = self.size
+
+        # topological order
+        num_parents = [len(graph.get_parents(node)) for node in range(size)]
+        self.order = [node for node in range(size) if 0 == num_parents[node]]
+        for node in self.order:
+            for child in graph.get_children(node):
+                num_parents[child] -= 1
+                if 0 == num_parents[child]:
+                    self.order.append(child)
+        self.acyclic = len(self.order) == size
+        self.position = array('i', [-1]) * size
+        for position, node in enumerate(self.order):
+            self.position[node] = position
+
+        # depth-first numbering, nodes are visited in sorted order of ids
+        self.numbered = array('i')
+        self.numbering_parents = array('i', [-1]) * size
+        self.begin = array('i', [-1]) * size
+        self.end = array('i', [-1]) * size
+        for root in range(size):
+            if self.begin[root] < 0 and (0 == len(graph.get_parents(root)) or self.position[root] < 0):
+                self._number(root)
+
+        # an interval is closed if its members have no children outside of it,
+        # bounds of children numbers are propagated from the end of numbering
+        first_child = [len(self.numbered)] * size
+        last_child = [-1] * size
+        self.closed = bytearray(size)
+        for node in reversed(self.numbered):
+            for child in graph.get_children(node):
+                first_child[node] = min(first_child[node], self.begin[child])
+                last_child[node] = max(last_child[node], self.begin[child])
+            self.closed[node] = self.begin[node] < first_child[node] and last_child[node] < self.end[node]
+            parent = self.numbering_parents[node]
+            if parent >= 0:
+                first_child[parent] = min(first_child[parent], first_child[node])
+                last_child[parent] = max(last_child[parent], last_child[node])
+
+        self.single_path = bytearray(size)
+        for node in self.order:
+            parents = graph.get_parents(node)
+            if 0 == len(parents) or (1 == len(parents) and self.single_path[parents[0]]):
+                self.single_path[node] = 1
+
+        # computed on demand since only nodes of views are queried
+        self.ancestor_sets = {}
+        self.descendant_counts = {}
+
+    def _number(self, root):
+        self.begin[root] = len(self.numbered)
+        self.numbered.append(root)
+        stack = [(root, iter(self.graph.get_children(root)))]
+        while stack:
+            node, children = stack[-1]
+            for child in children:
+                if self.begin[child] < 0:
+                    self.numbering_parents[child] = node
+                    self.begin[child] = len(self.numbered)
+                    self.numbered.append(child)
+                    stack.append((child, iter(self.graph.get_children(child))))
+                    break
+            else:
+                self.end[node] = len(self.numbered)
+                stack.pop()
+
+    def get_ancestors(self, index):
+        """Get indices of all scopes containing the given node."""
+        if index >= self.size:
+            return ()
+        if self.single_path[index]:
+            ancestors = []
+            parents = self.graph.get_parents(index)
+            while len(parents) > 0:
+                ancestors.append(parents[0])
+                parents = self.graph.get_parents(parents[0])
+            return ancestors
+        if index not in self.ancestor_sets:
+            ancestors = set()
+            to_visit = [index]
+            while to_visit:
+                for parent in self.graph.get_parents(to_visit.pop()):
+                    if parent not in ancestors:
+                        ancestors.add(parent)
+                        to_visit.append(parent)
+            self.ancestor_sets[index] = frozenset(ancestors)
+        return self.ancestor_sets[index]
+
+    def get_descendants(self, index):
+        """Get indices of all nodes in the given scope."""
+        if index >= self.size:
+            return set()
+        if self.closed[index]:
+            return set(self.numbered[self.begin[index] + 1:self.end[index]])
+
+        descendants = set()
+        to_visit = [index]
+        while to_visit:
+            for child in self.graph.get_children(to_visit.pop()):
+                if child not in descendants:
+                    descendants.add(child)
+                    to_visit.append(child)
+        return descendants
+
+    def count_descendants(self, index):
+        if index >= self.size:
+            return 0
+        if self.closed[index]:
+            return self.end[index] - self.begin[index] - 1
+        if index not in self.descendant_counts:
+            descendants = self.get_descendants(index)
+            descendants.discard(index)
+            self.descendant_counts[index] = len(descendants)
+        return self.descendant_counts[index]
+
+    def is_under(self, index, scope):
+        """Check if a node is contained in the given scope directly or indirectly."""
+        if index >= self.size or scope >= self.size:
+            return False
+        if self.single_path[index]:
+            return self.begin[scope] < self.begin[index] < self.end[scope]
+        return scope in self.get_ancestors(index)
+
+    def get_closest_scopes(self, view_nodes):
+        """Map view nodes and nodes in their scopes to the closest view node
+        containing them, i.e., the one with the least number of descendants,
+        ties are resolved by order of view nodes.
+        """
+        rank = {node: (self.count_descendants(node), order) for order, node in enumerate(view_nodes)}
+        closest_scope = {node: node for node in view_nodes}
+
+        members = set()
+        to_visit = [node for node in view_nodes if node < self.size]
+        while to_visit:
+            for child in self.graph.get_children(to_visit.pop()):
+                if child not in members and child not in rank:
+                    members.add(child)
+                    to_visit.append(child)
+
+        if not self.acyclic:
+            for node in sorted(view_nodes, key=rank.get):
+                for child in self.get_descendants(node):
+                    if child not in closest_scope:
+                        closest_scope[child] = node
+            return closest_scope
+
+        # closest scope of a node is the closest among closest scopes of its parents
+        for node in sorted(members, key=self.position.__getitem__):
+            candidates = [closest_scope[parent] for parent in self.graph.get_parents(node) if parent in closest_scope]
+            closest_scope[node] = min(candidates, key=rank.get)
+        return closest_scope
+
+
+class Reachability:
+    """Index of nodes reachable over edges, nodes and edges are restricted by
+    the given masks.
+
+    Strongly connected components of the restricted graph are condensed to a
+    DAG on the first query. Bitsets of nodes reachable from components are
+    memoized for each queried set of components, traversal of the DAG stops
+    at components with memoized bitsets.
+    """
+
+    opposite = {
+        'in': 'out',
+        'out': 'in',
+    }
+
+    def __init__(self, graph, node_mask, edge_mask):
+        self.graph = graph
+        self.size = graph.num_nodes
+        self.node_mask = node_mask
+        self.edge_mask = edge_mask
+
+        self.component = None
+        self.members = None
+        self.successors = None
+        self.closures = {'in': {}, 'out': {}}
+
+    def get_targets(self, node, direction):
+        """Get nodes connected with the given node by edges in the given direction."""
+        ends = self.graph.edge_ends[self.opposite[direction]]
+        return [
+            ends[edge] for edge in self.graph.get_edges(node, direction)
+            if self.edge_mask[edge] and self.node_mask[ends[edge]]
+        ]
+
+    def _condense(self):
+        # iterative Tarjan's algorithm, components are found in reverse topological order
+        size = self.size
+        self.component = array('i', [-1]) * size
+        self.members = []
+        order = array('i', [-1]) * size
+        low = array('i', [-1]) * size
+        on_stack = bytearray(size)
+        stack = []
+        counter = 0
+
+        for root in range(size):
+            if not self.node_mask[root] or order[root] >= 0:
+                continue
+            order[root] = low[root] = counter
+            counter += 1
+            stack.append(root)
+            on_stack[root] = 1
+            work = [(root, iter(self.get_targets(root, 'out')))]
+            while work:
+                node, targets = work[-1]
+                for target in targets:
+                    if order[target] < 0:
+                        order[target] = low[target] = counter
+                        counter += 1
+                        stack.append(target)
+                        on_stack[target] = 1
+                        work.append((target, iter(self.get_targets(target, 'out'))))
+                        break
+                    if on_stack[target]:
+                        low[node] = min(low[node], order[target])
+                else:
+                    work.pop()
+                    if work:
+                        parent = work[-1][0]
+                        low[parent] = min(low[parent], low[node])
+                    if low[node] == order[node]:
+                        members = []
+                        while True:
+                            member = stack.pop()
+                            on_stack[member] = 0
+                            self.component[member] = len(self.members)
+                            members.append(member)
+                            if member == node:
+                                break
+                        self.members.append(members)
+
+        pairs = set()
+        for node in range(size):
+            if self.node_mask[node]:
+                for target in self.get_targets(node, 'out'):
+                    if self.component[node] != self.component[target]:
+                        pairs.add((self.component[node], self.component[target]))
+        self.successors = {
+            'out': Adjacency(len(self.members), pairs),
+            'in': Adjacency(len(self.members), ((target, source) for source, target in pairs)),
+        }
+
+    def _get_closure(self, components, direction):
+        closures = self.closures[direction]
+        key = frozenset(components)
+        if key not in closures:
+            bits = 0
+            reached = []
+            visited = set(key)
+            to_visit = list(key)
+            while to_visit:
+                component = to_visit.pop()
+                memoized = closures.get(frozenset((component,)))
+                if memoized is not None:
+                    bits |= memoized
+                    continue
+                reached.extend(self.members[component])
+                for successor in self.successors[direction][component]:
+                    if successor not in visited:
+                        visited.add(successor)
+                        to_visit.append(successor)
+            closures[key] = bits | _to_bits(reached, self.size)
+        return closures[key]
+
+    def get_reachable(self, nodes, direction):
+        """Get indices of nodes reachable from the given nodes following
+        edges in the given direction. Given nodes excluded by the node mask
+        are traversed, but are not included in the result.
+        """
+        if self.component is None:
+            self._condense()
+
+        components = set()
+        for node in nodes:
+            if node >= self.size:
+                continue
+            if self.node_mask[node]:
+                components.add(self.component[node])
+            else:
+                components.update(self.component[target] for target in self.get_targets(node, direction))
+
+        if 0 == len(components):
+            return ()
+        return _from_bits(self._get_closure(components, direction))
+
+
+class Graph:
+    """Nodes and edges interned to integer indices with edge and scope adjacency.
+
+    Indices follow sorted order of ids, so that sorting of indices is
+    equivalent to sorting of ids.
+
+    Implicit `hh:scope:` and `hh:style:` tags are derived from the scope
+    hierarchy and the given style ancestors of entities, which should have
+    these tags.
+
+    Negated tag expressions select only entities that are not in the given
+    sets of bundled style ids, so that unused style templates are not added
+    to views.
+    """
+
+    def __init__(self, nodes, edges, node_style_tags=None, edge_style_tags=None,
+                 bundled_nodes=(), bundled_edges=()):
+        self.nodes = nodes
+        self.edges = edges
+
+        self.node_ids = sorted(nodes)
+        self.node_index = {key: index for index, key in enumerate(self.node_ids)}
+        self.num_nodes = len(self.node_ids)
+
+        self.edge_ids = sorted(edges)
+        self.edge_index = {key: index for index, key in enumerate(self.edge_ids)}
+        self.num_edges = len(self.edge_ids)
+
+        # edge index -> node index
+        self.edge_ends = {
+            'in': array('i', [self.node_index[edges[key].in_] for key in self.edge_ids]),
+            'out': array('i', [self.node_index[edges[key].out] for key in self.edge_ids]),
+        }
+        # node index -> edge indices
+        self.adjacent_edges = {
+            dir_key: Adjacency(self.num_nodes, ((node, edge) for edge, node in enumerate(ends)))
+            for dir_key, ends in self.edge_ends.items()
+        }
+
+        scope_pairs = []
+        for index, key in enumerate(self.node_ids):
+            if nodes[key].scope is not None:
+                for parent in nodes[key].scope:
+                    scope_pairs.append((index, self.node_index[parent]))
+        self.parent_lists = Adjacency(self.num_nodes, scope_pairs)
+        self.child_lists = Adjacency(self.num_nodes, ((parent, child) for child, parent in scope_pairs))
+        self.scopes = ScopeIndex(self)
+
+        # tags of nodes and edges must not change after the index is built
+        self.node_postings = _get_postings(nodes, self.node_ids)
+        self.edge_postings = _get_postings(edges, self.edge_ids)
+        self.node_styles = _group_by_styles(node_style_tags, self.node_index)
+        self.edge_styles = _group_by_styles(edge_style_tags, self.edge_index)
+        self.node_universe = ((1 << self.num_nodes) - 1) & ~_to_bits(
+            self.get_indices(bundled_nodes), self.num_nodes)
+        self.edge_universe = ((1 << self.num_edges) - 1) & ~_to_bits(
+            [self.edge_index[key] for key in bundled_edges], self.num_edges)
+        self.node_bits = {}
+        self.edge_bits = {}
+        self.edge_masks = {}
+        self.reachabilities = {}
+
+    def get_id(self, index):
+        return self.node_ids[index]
+
+    def get_index(self, key):
+        return self.node_index[key]
+
+    def get_ids(self, indices):
+        return {self.get_id(index) for index in indices}
+
+    def get_indices(self, keys):
+        return [self.get_index(key) for key in keys]
+
+    def get_mask(self, keys):
+        """Get membership bytearray of the given node ids."""
+        mask = bytearray(self.num_nodes)
+        for key in keys:
+            mask[self.get_index(key)] = 1
+        return mask
+
+    def get_node_bits(self, tag):
+        if tag not in self.node_bits:
+            indices = list(self.node_postings.get(tag, ()))
+            if tag.startswith(SCOPE_TAG_PREFIX):
+                scope = self.node_index.get(tag[len(SCOPE_TAG_PREFIX):])
+                if scope is not None:
+                    indices.extend(self.scopes.get_descendants(scope))
+            elif tag.startswith(STYLE_TAG_PREFIX):
+                indices.extend(_get_styled(self.node_styles, tag[len(STYLE_TAG_PREFIX):]))
+            self.node_bits[tag] = _to_bits(indices, self.num_nodes)
+        return self.node_bits[tag]
+
+    def get_edge_bits(self, tag):
+        if tag not in self.edge_bits:
+            indices = list(self.edge_postings.get(tag, ()))
+            if tag.startswith(STYLE_TAG_PREFIX):
+                indices.extend(_get_styled(self.edge_styles, tag[len(STYLE_TAG_PREFIX):]))
+            self.edge_bits[tag] = _to_bits(indices, self.num_edges)
+        return self.edge_bits[tag]
+
+    @staticmethod
+    def _select(tags, get_bits, universe):
+        # entities matching any of the tag expressions are selected
+        bits = 0
+        for tag in tags:
+            bits |= tag_query.compile_query(tag)(get_bits, universe)
+        return bits
+
+    def get_nodes_by_tags(self, tags):
+        """Get ids of nodes that match any of the given tag expressions."""
+        return self.get_ids(_from_bits(self._select(tags, self.get_node_bits, self.node_universe)))
+
+    def get_edge_mask_by_tags(self, tags):
+        """Get membership bytearray of edges that match any of the given tag
+        expressions, the mask is shared by all callers and must not be modified."""
+        key = frozenset(tags)
+        if key not in self.edge_masks:
+            mask = bytearray(self.num_edges)
+            for edge in _from_bits(self._select(key, self.get_edge_bits, self.edge_universe)):
+                mask[edge] = 1
+            self.edge_masks[key] = mask
+        return self.edge_masks[key]
+
+    def get_reachability(self, tags):
+        """Get reachability index over edges that match any of the given tag
+        expressions, the index is shared by all callers."""
+        key = frozenset(tags)
+        if key not in self.reachabilities:
+            node_mask = bytearray(b'\x01') * self.num_nodes
+            self.reachabilities[key] = Reachability(self, node_mask, self.get_edge_mask_by_tags(key))
+        return self.reachabilities[key]
+
+    def get_edges(self, index, dir_key):
+        return self.adjacent_edges[dir_key][index]
+
+    def get_parents(self, index):
+        return self.parent_lists[index]
+
+    def get_children(self, index):
+        return self.child_lists[index]
+
+    def sorted(self, indices):
+        return sorted(indices)
+
+
+class GraphOverlay:
+    """Graph with additional nodes and overridden node scopes, the underlying
+    graph is not modified.
+
+    Additional nodes have no edges and children, they can only be reached as
+    scopes of other nodes.
+    """
+
+    def __init__(self, graph):
+        self.graph = graph
+        self.nodes = graph.nodes
+        self.edges = graph.edges
+        self.edge_ids = graph.edge_ids
+        self.edge_ends = graph.edge_ends
+        self.num_edges = graph.num_edges
+        self.num_nodes = graph.num_nodes
+        # additional nodes are not a part of the scope hierarchy
+        self.scopes = graph.scopes
+
+        self.extra_ids = []
+        self.extra_index = {}
+        self.parent_overrides = {}
+
+    def add_node(self, key, parents):
+        index = self.num_nodes
+        self.extra_ids.append(key)
+        self.extra_index[key] = index
+        self.parent_overrides[index] = parents
+        self.num_nodes += 1
+        return index
+
+    def set_parents(self, index, parents):
+        self.parent_overrides[index] = parents
+
+    def get_id(self, index):
+        if index < self.graph.num_nodes:
+            return self.graph.node_ids[index]
+        return self.extra_ids[index - self.graph.num_nodes]
+
+    def get_index(self, key):
+        index = self.extra_index.get(key)
+        if index is None:
+            return self.graph.node_index[key]
+        return index
+
+    get_ids = Graph.get_ids
+    get_indices = Graph.get_indices
+    get_mask = Graph.get_mask
+
+    def get_edges(self, index, dir_key):
+        if index < self.graph.num_nodes:
+            return self.graph.get_edges(index, dir_key)
+        return ()
+
+    def get_parents(self, index):
+        if index in self.parent_overrides:
+            return self.parent_overrides[index]
+        return self.graph.get_parents(index)
+
+    def get_children(self, index):
+        if index < self.graph.num_nodes:
+            return self.graph.get_children(index)
+        return ()
+
+    def sorted(self, indices):
+        # additional nodes break correspondence of indices and ids
+        return sorted(indices, key=self.get_id)
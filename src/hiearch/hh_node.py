@@ -1,6 +1,5 @@
 """Module for handling hiearch nodes and their processing."""
 
-import copy
 from collections import defaultdict
 
 from . import util
@@ -22,6 +21,13 @@ default: dict = {
 }
 
 
+class Node(util.Entity):
+    """Node entity, keys are the same as in `default`."""
+
+    __slots__ = ('id', 'label', 'scope', 'style', 'style_notag', 'graphviz', 'tags', 'substitutions',
+                 'in_', 'out', 'child')
+
+
 def gather(prop, node, must_exist_nodes):
     """Gather nodes that must exist based on property references."""
     if prop in node.keys() and node[prop] is not None:
@@ -33,152 +39,225 @@ def gather(prop, node, must_exist_nodes):
     return False
 
 
-def postprocess(nodes, edges):
-    """Post-process nodes after parsing."""
+def postprocess(nodes, edges, style_ancestors=None):
+    """Post-process nodes after parsing.
+
+    Implicit `hh:scope:` and `hh:style:` tags are not added to nodes, they
+    are derived from scopes and styles when requested by views.
+
+    Returns:
+        Dictionary mapping ids of nodes with `hh:style:` tags to their style ancestors
+    """
     util.check_key_existence(nodes.must_exist, nodes.entities, 'node')
-    util.apply_styles(nodes.styled, nodes.entities)
+    ancestors = util.apply_styles(nodes.styled, nodes.entities, known_ancestors=style_ancestors, entity_type=Node)
 
+    # all nodes and edges are slotted entities at this point
     for node in nodes.entities.values():
-        node['out'] = set()
-        node['in'] = set()
-        node['child'] = set()
+        node.out = set()
+        node.in_ = set()
+        node.child = set()
 
-        original_scope = node['scope']
+        original_scope = node.scope
         if original_scope is not None:
             if isinstance(original_scope, list):
-                node['scope'] = set(original_scope)
+                node.scope = set(original_scope)
 
-                if len(original_scope) != len(node['scope']):
-                    raise RuntimeError(f'Duplicate scopes: {node["label"]} | scopes: [{original_scope}] | [{node["scope"]}]')
+                if len(original_scope) != len(node.scope):
+                    raise RuntimeError(f'Duplicate scopes: {node.label} | scopes: [{original_scope}] | [{node.scope}]')
             else:
-                node['scope'] = set([original_scope])
+                node.scope = set([original_scope])
 
     for key, edge in edges.items():
-        for dir_key in ['in', 'out']:
-            nodes.entities[edge[dir_key]][dir_key].add(key)
+        nodes.entities[edge.in_].in_.add(key)
+        nodes.entities[edge.out].out.add(key)
 
     for key, node in nodes.entities.items():
-        if node['scope'] is not None:
-            for parent in node['scope']:
-                nodes.entities[parent]['child'].add(key)
+        if node.scope is not None:
+            for parent in node.scope:
+                nodes.entities[parent].child.add(key)
 
-    for node in nodes.entities.values():
-        if not isinstance(node['tags'], set):
-            node['tags'] = util.ensure_set(node['tags'])
-        if node['scope'] is not None:
-            to_visit = set(node['scope'])
-            visited = set()
-            while to_visit:
-                scope_id = to_visit.pop()
-                if scope_id in visited:
-                    continue
-                visited.add(scope_id)
-                node['tags'].add(f'hh:scope:{scope_id}')
-                if scope_id in nodes.entities:
-                    parent = nodes.entities[scope_id]
-                    if parent.get('scope') is not None:
-                        to_visit.update(parent['scope'] - visited)
+    style_tags = {}
+    for key, node in nodes.entities.items():
+        if not isinstance(node.tags, set):
+            node.tags = util.ensure_set(node.tags)
         if node.get('style') is not None and node.get('style_notag') is None:
-            for ancestor in util.collect_style_ancestors(
-                    node['style'], nodes.entities):
-                node['tags'].add(f'hh:style:{ancestor}')
+            style_tags[key] = ancestors[key]
+
+    return style_tags
 
 
-def add_branch_to_tree(branch, tree, node_key_paths, scopes, index=0):
-    """Add a branch to the tree structure recursively."""
-    if index != len(branch):
-        node_key = branch[index]
+def add_branch_to_tree(branch, tree, node_key_paths, scopes):
+    """Add a branch to the tree structure."""
+    subtree = tree
+    key_path = None
+    for index, node_key in enumerate(branch):
         if index + 1 < len(branch):
-            if node_key in scopes:
-                scopes[node_key].add(branch[index + 1])
-            else:
-                scopes[node_key] = set([branch[index + 1]])
+            scopes.setdefault(node_key, set()).add(branch[index + 1])
 
-        if len(tree) > 0 and node_key in tree.keys():
-            tree[node_key] = {
-                    'subtree': add_branch_to_tree(branch, tree[node_key]['subtree'], node_key_paths, scopes, index + 1),
-                    'key_path': tree[node_key]['key_path']
+        key_path = node_key if key_path is None else f'{key_path}.{node_key}'
+        if node_key not in subtree:
+            subtree[node_key] = {
+                    'subtree': {},
+                    'key_path': key_path
             }
         else:
-            tree[node_key] = {
-                    'subtree': add_branch_to_tree(branch, {}, node_key_paths, scopes, index + 1),
-                    'key_path': '.'.join(branch[:index + 1])
-            }
+            key_path = subtree[node_key]['key_path']
 
-        node_key_paths[node_key].add(tree[node_key]['key_path'])
+        node_key_paths[node_key].add(key_path)
+        subtree = subtree[node_key]['subtree']
 
     return tree
 
 
-def build_tree(nodes, nodes_view):
-    """Build the tree structure from nodes and view information."""
-    rank = defaultdict(lambda: 0)
+def _raise_cycle(graph, path, node):
+    raise RuntimeError(f'Detected cycle in branch: {[graph.get_id(index) for index in path]} | {graph.get_id(node)}')
+
+
+def _get_view_parents(graph, nodes_view, view_mask):
+    """Get scope hierarchy restricted to the view: closest ancestors of view
+    nodes that belong to the view. Ancestors are listed in the order of
+    traversal, which is also used to break ties during branch merging: view
+    scopes first, scopes with greater ids first. Ancestors reachable through
+    multiple paths are listed once, at their first occurrence.
+    """
+    def get_parents(node):
+        parents = graph.sorted(graph.get_parents(node))
+        parents.reverse()
+        parents.sort(key=lambda parent: not view_mask[parent])
+        return parents
+
+    # lists of nodes outside of the view are shared by all their members
+    view_parents = {}
+    for start in nodes_view:
+        stack = [start]
+        expanded = set()
+        while stack:
+            node = stack[-1]
+            if node in view_parents:
+                stack.pop()
+                continue
+
+            parents = get_parents(node)
+            pending = [parent for parent in parents if not view_mask[parent] and parent not in view_parents]
+            if pending and node not in expanded:
+                for parent in pending:
+                    if parent in expanded:
+                        _raise_cycle(graph, [index for index in stack if index in expanded], parent)
+                expanded.add(node)
+                stack.extend(pending)
+                continue
+
+            node_parents = {}
+            for parent in parents:
+                if view_mask[parent]:
+                    node_parents[parent] = None
+                else:
+                    node_parents.update(dict.fromkeys(view_parents[parent]))
+            view_parents[node] = list(node_parents)
+            expanded.discard(node)
+            stack.pop()
+
+    return view_parents
+
+
+def build_tree(graph, nodes_view):
+    """Build the tree structure from nodes and view information.
+
+    Branches connecting view nodes to their roots are enumerated over the
+    scope hierarchy restricted to the view, branches of each leaf are merged
+    into a single branch. Scopes are traversed using node indices of the
+    graph, resulting tree is keyed by node ids.
+    """
+    view_mask = graph.get_mask(nodes_view)
+    view_nodes = graph.sorted(graph.get_indices(nodes_view))
+    view_nodes.reverse()
+    view_parents = _get_view_parents(graph, view_nodes, view_mask)
+
+    # rank is the number of occurrences of a node in branches starting at
+    # all view nodes, which is counted from leaves to roots instead of
+    # enumerating the branches
+    rank = {node: 1 for node in view_nodes}
+    num_members = {node: 0 for node in view_nodes}
+    for node in view_nodes:
+        for scope in view_parents[node]:
+            num_members[scope] += 1
+    nonleaf = {node for node in view_nodes if num_members[node] > 0}
+
+    counted = [node for node in view_nodes if 0 == num_members[node]]
+    for node in counted:
+        for scope in view_parents[node]:
+            rank[scope] += rank[node]
+            num_members[scope] -= 1
+            if 0 == num_members[scope]:
+                counted.append(scope)
+
+    if len(counted) != len(view_nodes):
+        # nodes that are not counted are in cycles or contain them, follow
+        # members that are not counted until a cycle is found
+        members = defaultdict(list)
+        for node in view_nodes:
+            for scope in view_parents[node]:
+                members[scope].append(node)
+        path = [next(node for node in view_nodes if num_members[node] > 0)]
+        while True:
+            member = next(member for member in members[path[-1]] if num_members[member] > 0)
+            if member in path:
+                branch = path[path.index(member):]
+                branch.reverse()
+                _raise_cycle(graph, branch, branch[0])
+            path.append(member)
 
     branches = defaultdict(lambda: [])
-    branch = [None]
-    scope_stack = [sorted(nodes_view)]
-
-    nonleaf = set()
-
-    def sorted_scope(scope_set):
-        result = sorted(scope_set)
-        result.sort(key=lambda s: s in nodes_view)
-        return result
-
-    while len(scope_stack) > 0:
-        if len(branch) > 0:
-            branch.pop()
-        updated_branch = False
-        while scope_stack[-1] is not None and len(scope_stack[-1]) > 0:
-            scope = scope_stack[-1].pop()
-
-            if scope in branch:
-                raise RuntimeError(f'Detected cycle in branch: {branch} | {scope}')
-            if scope in nodes_view:
-                rank[scope] += 1
-                updated_branch = True
-                branch.append(scope)
-                if len(branch) > 1:
-                    nonleaf.add(scope)
-
-            child_scope = nodes[scope].get('scope')
-            if child_scope is not None:
-                scope_stack.append(sorted_scope(child_scope))
-            else:
-                scope_stack.append(None)
-
-        if updated_branch:
-            branches[branch[0]].append(copy.deepcopy(branch))
-
-        scope_stack.pop()
-
-    scopes = {}
-    node_tree = {}
-    node_key_paths = defaultdict(set)
-    for key, branch_list in branches.items():
+    for start in view_nodes:
         # a node may appear both as a leaf and nonleaf in a view with
         # multiscoping, in such cases we should omit the leaf due to
         # redundancy
-        if key in nonleaf:
+        if start in nonleaf:
             continue
 
+        branch = [start]
+        iterators = [iter(view_parents[start])]
+        if 0 == len(view_parents[start]):
+            branches[start].append([start])
+
+        while iterators:
+            scope = next(iterators[-1], None)
+            if scope is None:
+                iterators.pop()
+                branch.pop()
+                continue
+
+            branch.append(scope)
+            if len(view_parents[scope]) > 0:
+                iterators.append(iter(view_parents[scope]))
+            else:
+                branches[start].append(list(branch))
+                branch.pop()
+
+    scopes = {}
+    node_tree = {}
+    node_key_paths = defaultdict(set)
+    for branch_list in branches.values():
         branch_list.sort(key=len, reverse=True)
         branch = branch_list[0]
         for branch_merge in branch_list[1:]:
             index = 0
             for node in branch_merge:
-                # if we reached the end of the original branch, or the nodes do not match
-                # find a place where the node must be inserted
-                if index == len(branch) or node != branch[index]:
-                    while index < len(branch) and rank[node] > rank[branch[index]]:
-                        index += 1
-                    if index < len(branch) and rank[node] == rank[branch[index]] and node > branch[index]:
-                        index += 1
-                    branch.insert(index, node)
+                # the node may be already merged from another branch, e.g.,
+                # when it is both a direct scope and a scope of another scope
+                if node in branch:
+                    index = branch.index(node) + 1
+                    continue
+                # otherwise find a place where the node must be inserted
+                while index < len(branch) and rank[node] > rank[branch[index]]:
+                    index += 1
+                if index < len(branch) and rank[node] == rank[branch[index]] and graph.get_id(node) > graph.get_id(branch[index]):
+                    index += 1
+                branch.insert(index, node)
                 index += 1
 
         branch.reverse()
-        node_tree = add_branch_to_tree(branch, node_tree, node_key_paths, scopes)
+        node_tree = add_branch_to_tree([graph.get_id(node) for node in branch], node_tree, node_key_paths, scopes)
 
 
     return node_tree, node_key_paths, scopes
@@ -205,25 +284,16 @@ def parse(yaml_nodes, nodes):
             nodes.styled.append(node)
             nodes.entities[key] = node
         else:
-            nodes.entities[key] = util.merge_styles(default, node)
+            nodes.entities[key] = Node(util.merge_styles(default, node))
 
 
 def get_substitutions(node):
     """Get substitution values for formatting node labels."""
-    substitutions = dict(node['substitutions'])
+    substitutions = dict(node.substitutions)
     substitutions.update({
-        'label': node['label'],
-        'id': node['id'],
-        'scope': node['scope'],
-        'style': node['style']
+        'label': node.label,
+        'id': node.id,
+        'scope': node.scope,
+        'style': node.style
     })
     return substitutions
-
-
-def get_nodes_by_tag(nodes, tag):
-    """Get all nodes that have a specific tag."""
-    selection = []
-    for node in nodes.values():
-        if tag in node['tags']:
-            selection.append(node['id'])
-    return set(selection)
@@ -1,9 +1,10 @@
 """Module for handling hiearch views and their processing."""
 
 import copy
-from collections import deque
+from collections import ChainMap, defaultdict
 
 from . import hh_edge
+from . import hh_graph
 from . import hh_node
 from . import util
 
@@ -39,273 +40,288 @@ default: dict = {
 }
 
 
+class View(util.Entity):
+    """View entity, keys are the same as in `default` with addition of
+    `node_key_paths` and `scopes`, which are generated with the tree, and
+    `extra_nodes` of expanded views, see `get_nodes()`."""
+
+    __slots__ = ('id', 'nodes', 'neighbours', 'graphviz', 'style', 'tags', 'edge_tags', 'edges', 'custom_edges',
+                 'tree', 'expand', 'nodes_subset', 'expanded_from', 'node_key_paths', 'scopes', 'extra_nodes')
+
+
+def get_nodes(view, nodes):
+    """Get mapping of node ids to nodes of the view, nodes that are generated
+    for expanded views are not added to global nodes."""
+    extra_nodes = view.get('extra_nodes')
+    if extra_nodes is None:
+        return nodes
+    return ChainMap(extra_nodes, nodes)
+
+
 opposite = {
     'in': 'out',
     'out': 'in',
 }
 
 
-def select_explicit(view, nodes, edges):
+def _add_edge(view, graph, edge):
+    # edges are not modified after selection and are shared by views
+    edge_key = graph.edge_ids[edge]
+    if edge_key not in view.edges:
+        view.edges[edge_key] = graph.edges[edge_key]
+
+
+def select_explicit(view, graph, edge_mask):
     """Select edges that connect explicitly requested nodes."""
-    for node_key in view['nodes']:
+    view_mask = graph.get_mask(view.nodes)
+    for node in graph.get_indices(view.nodes):
         for dir_key in ['in', 'out']:
-            for edge_key in nodes[node_key][dir_key]:
-                if edge_key not in edges:
-                    continue
-                if edges[edge_key][opposite[dir_key]] in view['nodes']:
-                    view['edges'][edge_key] = copy.deepcopy(edges[edge_key])
+            opposite_ends = graph.edge_ends[opposite[dir_key]]
+            for edge in graph.get_edges(node, dir_key):
+                if edge_mask[edge] and view_mask[opposite_ends[edge]]:
+                    _add_edge(view, graph, edge)
 
 
-def select_direct(view, nodes, edges, add_nodes):
+def select_direct(view, graph, node_mask, edge_mask, add_nodes):
     """Select edges that connect directly to requested nodes."""
-    for node_key in view['nodes']:
+    for node in graph.get_indices(view.nodes):
         for dir_key in ['in', 'out']:
-            opp_dir_key = opposite[dir_key]
-            for edge_key in nodes[node_key][dir_key]:
-                if edge_key not in edges:
-                    continue
-                if edges[edge_key][opp_dir_key] in nodes:
-                    view['edges'][edge_key] = copy.deepcopy(edges[edge_key])
+            opposite_ends = graph.edge_ends[opposite[dir_key]]
+            for edge in graph.get_edges(node, dir_key):
+                if edge_mask[edge] and node_mask[opposite_ends[edge]]:
+                    _add_edge(view, graph, edge)
 
-    for edge_key in view['edges']:
+    for edge_key in view.edges:
+        edge = graph.edge_index[edge_key]
         for dir_key in ['in', 'out']:
-            add_nodes.add(edges[edge_key][dir_key])
+            add_nodes.add(graph.edge_ends[dir_key][edge])
 
 
-def select_direct_with_parents(view, nodes, edges, add_nodes):
+def select_direct_with_parents(view, graph, node_mask, edge_mask, add_nodes):
     """Select directly connected nodes and all their parent scopes."""
-    select_direct(view, nodes, edges, add_nodes)
+    select_direct(view, graph, node_mask, edge_mask, add_nodes)
 
-    to_process = set(add_nodes)
+    to_process = list(add_nodes)
     while to_process:
-        node_key = to_process.pop()
-        node = nodes[node_key]
-        while node['scope'] is not None:
-            next_scope = None
-            for scope_id in node['scope']:
-                if scope_id in nodes and scope_id not in add_nodes:
-                    add_nodes.add(scope_id)
-                    if next_scope is None:
-                        next_scope = scope_id
-                    else:
-                        to_process.add(scope_id)
-            if next_scope is not None:
-                node = nodes[next_scope]
-            else:
-                break
+        node = to_process.pop()
+        for parent in graph.get_parents(node):
+            if node_mask[parent] and parent not in add_nodes:
+                add_nodes.add(parent)
+                to_process.append(parent)
 
 
-def select_parent(view, nodes, edges, add_nodes):
+def select_parent(view, graph, node_mask, edge_mask, add_nodes):
     """Select parent nodes and edges that connect to them."""
-    for node_key in view['nodes']:
+    view_mask = graph.get_mask(view.nodes)
+    for node in graph.sorted(graph.get_indices(view.nodes)):
         for dir_key in ['in', 'out']:
             opp_dir_key = opposite[dir_key]
-            for edge_key in nodes[node_key][dir_key]:
-                if edge_key not in edges:
+            opposite_ends = graph.edge_ends[opp_dir_key]
+            for edge in graph.get_edges(node, dir_key):
+                if not edge_mask[edge]:
                     continue
-                nodes_to_explore = set([edges[edge_key][opp_dir_key]])
+                nodes_to_explore = set([opposite_ends[edge]])
 
                 while len(nodes_to_explore) > 0:
-                    scope_node_key = nodes_to_explore.pop()
-                    if scope_node_key not in nodes:
+                    scope_node = nodes_to_explore.pop()
+                    if not node_mask[scope_node]:
                         continue
 
                     # go up the tree until reached an explicitly requested or a root node
-                    while scope_node_key not in view['nodes'] and nodes[scope_node_key]['scope'] is not None:
-                        scope_copy = copy.deepcopy(nodes[scope_node_key]['scope'])
-                        scope_node_key = scope_copy.pop()
-                        nodes_to_explore = nodes_to_explore.union(scope_copy)
+                    while not view_mask[scope_node] and len(graph.get_parents(scope_node)) > 0:
+                        parents = graph.get_parents(scope_node)
+                        scope_node = parents[0]
+                        nodes_to_explore.update(parents[1:])
 
-                    if scope_node_key in add_nodes:  # same node can be reached in multiple ways
+                    if scope_node in add_nodes:  # same node can be reached in multiple ways
                         continue
 
-                    add_nodes.add(scope_node_key)
-                    if scope_node_key == edges[edge_key][opp_dir_key]:
-                        view['edges'][edge_key] = copy.deepcopy(edges[edge_key])
+                    add_nodes.add(scope_node)
+                    if scope_node == opposite_ends[edge]:
+                        _add_edge(view, graph, edge)
                     else:
                         # generate edge with a parent
-                        new_edge = copy.deepcopy(edges[edge_key])
-                        new_edge[opp_dir_key] = scope_node_key
+                        new_edge = hh_edge.Edge(graph.edges[graph.edge_ids[edge]])
+                        new_edge[opp_dir_key] = graph.get_id(scope_node)
                         hh_edge.generate_id(new_edge)
-                        view['custom_edges'][new_edge['id']] = new_edge
+                        view.custom_edges[new_edge.id] = new_edge
 
 
-def select_recursive(view, nodes, edges, add_nodes, direction):
-    """Recursively select nodes in a specific direction (in or out)."""
-    # Select connected nodes
-    add_nodes.update(view['nodes'])
-    add_nodes_list = list(view['nodes'])
+def _traverse(graph, node_mask, edge_mask, add_nodes, view_nodes, direction):
+    """Select connected nodes without traversing nodes that are already selected."""
+    connected_ends = graph.edge_ends[opposite[direction]]
+    add_nodes_list = list(view_nodes)
     index = 0
-    original_size = len(add_nodes_list)
 
     while index < len(add_nodes_list):
-        edge_keys = nodes[add_nodes_list[index]][direction]
-        for edge_key in edge_keys:
-            if edge_key not in edges:
+        for edge in graph.get_edges(add_nodes_list[index], direction):
+            if not edge_mask[edge]:
                 continue
-            if direction == 'in':
-                connected_node = edges[edge_key]['out']
-            else:
-                connected_node = edges[edge_key]['in']
+            connected_node = connected_ends[edge]
 
-            if connected_node not in nodes:
+            if not node_mask[connected_node]:
                 continue
 
-            view['edges'][edge_key] = copy.deepcopy(edges[edge_key])
-
             # Check if connected node is not already selected
             if connected_node not in add_nodes:
                 add_nodes_list.append(connected_node)
                 add_nodes.add(connected_node)
         index += 1
 
+    return add_nodes_list[len(view_nodes):]
+
+
+def select_recursive(view, graph, reachability, add_nodes, direction):
+    """Recursively select nodes in a specific direction (in or out).
+
+    Connected nodes are looked up in the reachability index, which is
+    restricted by node and edge masks. Nodes selected before, e.g., in the
+    opposite direction, are not traversed, the index is not applicable if
+    they are reachable.
+    """
+    node_mask = reachability.node_mask
+    edge_mask = reachability.edge_mask
+    view_nodes = graph.sorted(graph.get_indices(view.nodes))
+    connected_ends = graph.edge_ends[opposite[direction]]
+
+    # Select connected nodes
+    reachable = set(reachability.get_reachable(view_nodes, direction))
+    reachable.difference_update(view_nodes)
+    if add_nodes.isdisjoint(reachable):
+        add_nodes.update(view_nodes)
+        add_nodes.update(reachable)
+        add_nodes_list = sorted(reachable)
+    else:
+        add_nodes.update(view_nodes)
+        add_nodes_list = _traverse(graph, node_mask, edge_mask, add_nodes, view_nodes, direction)
+
+    for node in view_nodes + add_nodes_list:
+        for edge in graph.get_edges(node, direction):
+            if edge_mask[edge] and node_mask[connected_ends[edge]]:
+                _add_edge(view, graph, edge)
+
     # Process parents of the newly selected nodes (excluding the original view nodes)
-    index = original_size
+    index = 0
     while index < len(add_nodes_list):
-        node = nodes[add_nodes_list[index]]
+        node = add_nodes_list[index]
         skip = False
-        while node['scope'] is not None and not skip:
-            for node_id in node['scope']:
-                if node_id not in nodes:
+        while len(graph.get_parents(node)) > 0 and not skip:
+            for parent in graph.get_parents(node):
+                if not node_mask[parent]:
                     skip = True
                     continue
 
-                node = nodes[node_id]
-                if node_id not in add_nodes:
-                    add_nodes_list.append(node_id)
-                    add_nodes.add(node_id)
+                node = parent
+                if parent not in add_nodes:
+                    add_nodes_list.append(parent)
+                    add_nodes.add(parent)
         index += 1
 
-    add_nodes.difference_update(view['nodes'])
+    add_nodes.difference_update(view_nodes)
 
 
-def select_neighbours_for_view(view, nodes, edges):
-    """Apply neighbour selection logic to a single view"""
-    if 0 == len(view['nodes']):
+def select_neighbours_for_view(view, graph, node_mask, edge_mask, reachability=None):
+    """Apply neighbour selection logic to a single view.
+
+    `node_mask` and `edge_mask` restrict selection to a subset of nodes and
+    edges of the graph, recursive selection uses `reachability` index built
+    with the same masks, the index is created if not given.
+    """
+    if 0 == len(view.nodes):
         return
 
-    view['edges'] = {}
-    view['custom_edges'] = {}
+    view.edges = {}
+    view.custom_edges = {}
     add_nodes = set()
 
-    if Neighbours.EXPLICIT == view['neighbours']:
-        select_explicit(view, nodes, edges)
+    if Neighbours.EXPLICIT == view.neighbours:
+        select_explicit(view, graph, edge_mask)
 
-    elif Neighbours.DIRECT == view['neighbours']:
-        select_direct(view, nodes, edges, add_nodes)
+    elif Neighbours.DIRECT == view.neighbours:
+        select_direct(view, graph, node_mask, edge_mask, add_nodes)
 
-    elif Neighbours.DIRECT_WITH_PARENTS == view['neighbours']:
-        select_direct_with_parents(view, nodes, edges, add_nodes)
+    elif Neighbours.DIRECT_WITH_PARENTS == view.neighbours:
+        select_direct_with_parents(view, graph, node_mask, edge_mask, add_nodes)
 
-    elif Neighbours.PARENT == view['neighbours']:
-        select_parent(view, nodes, edges, add_nodes)
+    elif Neighbours.PARENT == view.neighbours:
+        select_parent(view, graph, node_mask, edge_mask, add_nodes)
 
-    elif Neighbours.RECURSIVE_IN == view['neighbours']:
-        select_recursive(view, nodes, edges, add_nodes, 'in')
+    elif view.neighbours in (Neighbours.RECURSIVE_IN, Neighbours.RECURSIVE_OUT, Neighbours.RECURSIVE_ALL):
+        if reachability is None:
+            reachability = hh_graph.Reachability(graph, node_mask, edge_mask)
 
-    elif Neighbours.RECURSIVE_OUT == view['neighbours']:
-        select_recursive(view, nodes, edges, add_nodes, 'out')
+        if Neighbours.RECURSIVE_IN == view.neighbours:
+            select_recursive(view, graph, reachability, add_nodes, 'in')
 
-    elif Neighbours.RECURSIVE_ALL == view['neighbours']:
-        select_recursive(view, nodes, edges, add_nodes, 'out')
-        select_recursive(view, nodes, edges, add_nodes, 'in')
+        elif Neighbours.RECURSIVE_OUT == view.neighbours:
+            select_recursive(view, graph, reachability, add_nodes, 'out')
+
+        else:
+            select_recursive(view, graph, reachability, add_nodes, 'out')
+            select_recursive(view, graph, reachability, add_nodes, 'in')
 
     else:
         raise RuntimeError(f'Unsupported neighbours type: {view["neighbours"]}, must be one of {Neighbours.types}.')
 
     if len(add_nodes) > 0:
-        view['nodes'] = view['nodes'].union(add_nodes)
-
-
-def _get_descendants(view_nodes, nodes):
-    """Compute descendant ID sets and closest-scope mapping."""
-    descendants = {}
-    closest_scope = {}
-    for node_key in view_nodes:
-        closest_scope[node_key] = node_key
-        descendants[node_key] = set()
-        queue = deque([node_key])
-        visited = {node_key}
-        while queue:
-            curr = queue.popleft()
-            for child in nodes[curr]['child']:
-                if child not in visited:
-                    visited.add(child)
-                    descendants[node_key].add(child)
-                    queue.append(child)
-
-    sorted_view_nodes = sorted(view_nodes, key=lambda k: len(descendants[k]))
-    for node_key in sorted_view_nodes:
-        for child in descendants[node_key]:
-            if child not in view_nodes and child not in closest_scope:
-                closest_scope[child] = node_key
-    return descendants, closest_scope
-
-
-def build_tree(view, nodes, edges):
+        view.nodes = view.nodes.union(graph.get_ids(add_nodes))
+
+
+def build_tree(view, graph, edge_mask):
     """Build tree structure and promote edges between scope nodes.
 
     When a view contains scope nodes (parents) but not their children, edges
     between those children are automatically promoted to the scope level,
     producing edges between the scope nodes themselves.
     """
-    view_nodes = view['nodes']
+    view_nodes = graph.sorted(graph.get_indices(view.nodes))
+    edge_in = graph.edge_ends['in']
 
-    descendants, closest_scope = _get_descendants(view_nodes, nodes)
+    closest_scope = graph.scopes.get_closest_scopes(view_nodes)
 
     existing_connections = set()
-    for edge in view['edges'].values():
-        existing_connections.add((edge['out'], edge['in']))
-    for edge in view['custom_edges'].values():
-        existing_connections.add((edge['out'], edge['in']))
-
-    for a_node in view_nodes:
-        source_nodes = [a_node] + [c for c in descendants[a_node] if c not in view_nodes and closest_scope.get(c) == a_node]
-        for b_node in view_nodes:
-            if a_node == b_node:
-                continue
-            if b_node in descendants[a_node] or a_node in descendants[b_node]:
-                continue
-            if (a_node, b_node) in existing_connections:
-                continue
-
-            promoted_edges = []
-            for source in source_nodes:
-                for edge_key in nodes[source]['out']:
-                    if edge_key not in edges:
-                        continue
-                    edge_data = edges[edge_key]
-                    far_node = edge_data['in']
-                    if far_node == b_node:
-                        promoted_edges.append(edge_key)
-                    elif far_node not in view_nodes and far_node in closest_scope and closest_scope[far_node] == b_node:
-                        promoted_edges.append(edge_key)
-            edge_count = len(promoted_edges)
-
-            if edge_count == 0:
-                continue
+    for edge_set in [view.edges, view.custom_edges]:
+        for edge in edge_set.values():
+            existing_connections.add((graph.get_index(edge.out), graph.get_index(edge.in_)))
+
+    # project endpoints of edges to their closest scopes in the view and
+    # group edges by projected pairs, edges inside a scope are ignored
+    promoted_edges = defaultdict(list)
+    for source, a_node in closest_scope.items():
+        for edge in graph.get_edges(source, 'out'):
+            if edge_mask[edge]:
+                b_node = closest_scope.get(edge_in[edge])
+                if b_node is not None and b_node != a_node:
+                    promoted_edges[(a_node, b_node)].append(edge)
+
+    for (a_node, b_node), edges in promoted_edges.items():
+        if graph.scopes.is_under(b_node, a_node) or graph.scopes.is_under(a_node, b_node):
+            continue
+        if (a_node, b_node) in existing_connections:
+            continue
 
-            if edge_count == 1:
-                new_edge = copy.deepcopy(edges[promoted_edges[0]])
-            else:
-                promoted_tags = set()
-                for promoted_key in promoted_edges:
-                    promoted_tags.update(edges[promoted_key]['tags'])
-                new_edge = copy.deepcopy(hh_edge.default)
-                new_edge['tags'] = promoted_tags
-                new_edge['label'] = ['', f'({edge_count})', '']
-                new_edge['graphviz']['label_format'] = ['{label}', '{label}', '{label}']
+        edge_count = len(edges)
+        if edge_count == 1:
+            # attributes of the original edge are shared, only endpoints are replaced
+            new_edge = hh_edge.Edge(graph.edges[graph.edge_ids[edges[0]]])
+        else:
+            promoted_tags = set()
+            for promoted in edges:
+                promoted_tags.update(graph.edges[graph.edge_ids[promoted]].tags)
+            new_edge = hh_edge.Edge(copy.deepcopy(hh_edge.default))
+            new_edge.tags = promoted_tags
+            new_edge.label = ['', f'({edge_count})', '']
+            new_edge.graphviz['label_format'] = ['{label}', '{label}', '{label}']
 
-            new_edge['out'] = a_node
-            new_edge['in'] = b_node
-            hh_edge.generate_id(new_edge)
-            view['custom_edges'][new_edge['id']] = new_edge
-            existing_connections.add((a_node, b_node))
+        new_edge.out = graph.get_id(a_node)
+        new_edge.in_ = graph.get_id(b_node)
+        hh_edge.generate_id(new_edge)
+        view.custom_edges[new_edge.id] = new_edge
 
-    view['tree'], view['node_key_paths'], view['scopes'] = hh_node.build_tree(nodes, view['nodes'])
+    view.tree, view.node_key_paths, view.scopes = hh_node.build_tree(graph, view.nodes)
 
 
-def _resolve_view_nodes(views, nodes):
+def _resolve_view_nodes(views, graph):
     empty_views_counter = 0
     for view in views.entities.values():
         if view['nodes'] is None:
@@ -327,23 +343,22 @@ def _resolve_view_nodes(views, nodes):
         if 0 == len(view['edge_tags']):
             view['edge_tags'] = {'default'}
 
-        for tag in view['tags']:
-            view['nodes'] = view['nodes'].union(hh_node.get_nodes_by_tag(nodes, tag))
+        view['nodes'] = view['nodes'].union(graph.get_nodes_by_tags(view['tags']))
 
         if 0 == len(view['nodes']):
             empty_views_counter += 1
             continue
 
     if empty_views_counter == len(views.entities):
-        views.entities['default'] = default
+        views.entities['default'] = View(default)
         views.entities['default']['tags'] = {'default'}
-        views.entities['default']['nodes'] = hh_node.get_nodes_by_tag(nodes, 'default')
+        views.entities['default']['nodes'] = graph.get_nodes_by_tags({'default'})
         views.entities['default']['edge_tags'] = {'default'}
         if 0 == len(views.entities['default']['nodes']):
             raise RuntimeError(f'All views are empty: {views.entities.keys()}')
 
 
-def _expand_views(views, nodes, edges):
+def _expand_views(views, graph):
     additional_views = {}
 
     for view_id, view in views.entities.items():
@@ -355,20 +370,22 @@ def _expand_views(views, nodes, edges):
 
         view['expanded_from'] = view_id
 
-        nodes_subset = {}
-        for node_id in view['nodes']:
-            nodes_subset[node_id] = nodes[node_id]
+        view_mask = graph.get_mask(view['nodes'])
+        expand_edge_mask = graph.get_edge_mask_by_tags(view['edge_tags'])
+        # overlays of expanded views add a single highlight scope, which
+        # is included in the node mask, the index is shared by all of them
+        expand_node_mask = view_mask + b'\x01'
+        reachability = hh_graph.Reachability(graph, expand_node_mask, expand_edge_mask)
 
         for expand_type in view['expand']:
             if expand_type not in ['recursive_in', 'recursive_out', 'recursive_all']:
                 raise RuntimeError(f'Unsupported expand type: "{expand_type}" in view "{view_id}".')
 
-            expand_edges = hh_edge.get_edges_by_tags(edges, view['edge_tags'])
             for node_id in view['nodes']:
                 new_view_id = f"{view_id}_{node_id}_{expand_type}"
                 highlight_scope_id = f"{new_view_id}_highlight_scope"
 
-                nodes[highlight_scope_id] = util.merge_styles(
+                highlight_scope_node = hh_node.Node(util.merge_styles(
                         hh_node.default,
                         {
                             'id': highlight_scope_id,
@@ -381,40 +398,54 @@ def _expand_views(views, nodes, edges):
                             },
                             'in': set(),
                             'out': set(),
-                            'scope': nodes[node_id]['scope']
-                        })
-                nodes_subset[highlight_scope_id] = nodes[highlight_scope_id]
-
-                new_view = copy.deepcopy(view)
+                            'scope': graph.nodes[node_id]['scope']
+                        }))
+
+                # highlight scope is inserted between the node and its
+                # parents in an overlay, the graph is not modified
+                overlay = hh_graph.GraphOverlay(graph)
+                node = graph.get_index(node_id)
+                highlight_scope = overlay.add_node(highlight_scope_id, graph.get_parents(node))
+                overlay.set_parents(node, [highlight_scope])
+
+                # expanded view shares data of the original view, selection
+                # and tree building replace generated fields
+                new_view = View(view)
                 new_view['id'] = new_view_id
                 new_view['nodes'] = set([node_id, highlight_scope_id])
+                new_view['extra_nodes'] = {highlight_scope_id: highlight_scope_node}
                 new_view['neighbours'] = getattr(Neighbours, expand_type.upper())
 
-                original_scope = nodes[node_id]['scope']
-                nodes[node_id]['scope'] = set([highlight_scope_id])
-                select_neighbours_for_view(new_view, nodes_subset, expand_edges)
-                build_tree(new_view, nodes, expand_edges)
-                nodes[node_id]['scope'] = original_scope
+                select_neighbours_for_view(new_view, overlay, expand_node_mask, expand_edge_mask, reachability)
+                build_tree(new_view, overlay, expand_edge_mask)
 
                 additional_views[new_view_id] = new_view
 
     views.entities.update(additional_views)
 
 
-def postprocess(views, nodes, edges):
-    """Post-process views after parsing."""
+def postprocess(views, nodes, edges, node_style_tags=None, edge_style_tags=None,
+                bundled_nodes=(), bundled_edges=()):
+    """Post-process views after parsing, style tags are returned by node and
+    edge post-processing, bundled ids are ids of nodes and edges loaded from
+    bundled styles."""
     util.check_key_existence(views.must_exist, views.entities, 'view')
-    util.apply_styles(views.styled, views.entities, is_view=True)
+    util.apply_styles(views.styled, views.entities, is_view=True, entity_type=View)
+
+    # index is built once after nodes are post-processed and is shared by all views
+    graph = hh_graph.Graph(nodes, edges, node_style_tags, edge_style_tags, bundled_nodes, bundled_edges)
 
-    _resolve_view_nodes(views, nodes)
+    _resolve_view_nodes(views, graph)
+    node_mask = bytearray(b'\x01') * graph.num_nodes
 
     for view in views.entities.values():
         if len(view['nodes']) > 0:
-            view_edges = hh_edge.get_edges_by_tags(edges, view['edge_tags'])
-            select_neighbours_for_view(view, nodes, view_edges)
-            build_tree(view, nodes, view_edges)
+            edge_mask = graph.get_edge_mask_by_tags(view['edge_tags'])
+            reachability = graph.get_reachability(view['edge_tags'])
+            select_neighbours_for_view(view, graph, node_mask, edge_mask, reachability)
+            build_tree(view, graph, edge_mask)
 
-    _expand_views(views, nodes, edges)
+    _expand_views(views, graph)
 
 
 def parse(yaml_views, views, must_exist_nodes):
@@ -431,7 +462,7 @@ def parse(yaml_views, views, must_exist_nodes):
 
             views.entities[key] = view
         else:
-            views.entities[key] = util.merge_styles(default, view, is_view=True)
+            views.entities[key] = View(util.merge_styles(default, view, is_view=True))
 
         if 'nodes' in view:
             for node in view['nodes']:
@@ -2,6 +2,7 @@
 """Main hiearch module for generating diagrams from textual descriptions."""
 
 import argparse
+import concurrent.futures
 import fnmatch
 import os
 import sys
@@ -9,12 +10,15 @@ import shutil
 import importlib_resources
 import yaml
 
+from . import cache
 from . import graphviz_input
 from . import graphviz_output
 from . import hh_edge
 from . import hh_node
 from . import hh_view
 from . import output
+from . import styles
+from . import util
 
 
 class ParsedEntities:
@@ -25,41 +29,145 @@ class ParsedEntities:
         self.must_exist = set()
         self.styled = []
 
+    def merge(self, other, data_type):
+        """Merge entities parsed separately, e.g., from a different file."""
+        for key, entity in other.entities.items():
+            if key in self.entities:
+                raise RuntimeError(f'Duplicate {data_type} id: {key}')
+            self.entities[key] = entity
+        self.must_exist.update(other.must_exist)
+        self.styled.extend(other.styled)
 
-def parse(temp_dir, filenames, resource_dirs=None):
-    nodes = ParsedEntities()
-    edges = ParsedEntities()
-    views = ParsedEntities()
 
-    for filename in filenames:
-        print(f'Processing {filename}')
-        if filename.endswith('.dot') or filename.endswith('.gv'):
+def _load_data(temp_dir, filename, input_cache):
+    with open(filename, 'rb') as file:
+        content = file.read()
+
+    is_dot = filename.endswith('.dot') or filename.endswith('.gv')
+    file_id = os.path.basename(filename) if is_dot else ''
+
+    data = None
+    cache_key = None
+    if input_cache is not None:
+        cache_key = input_cache.get_key(file_id, content)
+        data = input_cache.load(cache_key)
+
+    if data is None:
+        if is_dot:
             # Handle DOT files by converting them to hiearch YAML representation directly
-            with open(filename, 'r', encoding='utf-8') as file:
-                content = file.read()
-            data = graphviz_input.dot_to_hiearch(os.path.basename(filename), content)
-
-            # Store the generated YAML in the temporary directory
-            temp_yaml_path = f'{temp_dir}/{os.path.basename(filename)}.yaml'
-            with open(temp_yaml_path, 'w', encoding='utf-8') as file:
-                yaml.dump(data, file, default_flow_style=False, allow_unicode=True)
+            data = graphviz_input.dot_to_hiearch(file_id, content.decode('utf-8'))
         else:
             # Process YAML files as usual
-            with open(filename, encoding='utf-8') as file:
-                data = yaml.load(file, Loader=yaml.SafeLoader)
+            data = yaml.load(content.decode('utf-8'), Loader=yaml.SafeLoader)
+
+        if input_cache is not None:
+            # must be stored before parsing, which modifies data in place
+            input_cache.store(cache_key, data)
+
+    if is_dot:
+        # Store the generated YAML in the temporary directory, also when
+        # data is loaded from the cache
+        temp_yaml_path = f'{temp_dir}/{file_id}.yaml'
+        with open(temp_yaml_path, 'w', encoding='utf-8') as file:
+            yaml.dump(data, file, default_flow_style=False, allow_unicode=True)
+
+    return data
+
 
-        if 'nodes' in data:
-            hh_node.parse(data['nodes'], nodes)
+def _parse_data(data, nodes, edges, views):
+    if 'nodes' in data:
+        hh_node.parse(data['nodes'], nodes)
+
+    if 'edges' in data:
+        hh_edge.parse(data['edges'], edges, nodes.must_exist)
+
+    if 'views' in data:
+        hh_view.parse(data['views'], views, nodes.must_exist)
+
+
+def _parse_file(temp_dir, filename, nodes, edges, views, input_cache=None):
+    print(f'Processing {filename}')
+    _parse_data(_load_data(temp_dir, filename, input_cache), nodes, edges, views)
+
+
+def _parse_file_entities(temp_dir, filename, input_cache=None):
+    """Parse a file into separate node, edge, and view containers, executed by parallel jobs."""
+    nodes = ParsedEntities()
+    edges = ParsedEntities()
+    views = ParsedEntities()
+    _parse_data(_load_data(temp_dir, filename, input_cache), nodes, edges, views)
+    return nodes, edges, views
 
-        if 'edges' in data:
-            hh_edge.parse(data['edges'], edges, nodes.must_exist)
 
-        if 'views' in data:
-            hh_view.parse(data['views'], views, nodes.must_exist)
+def _parse_files_parallel(temp_dir, filenames, nodes, edges, views, input_cache, jobs):
+    with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as executor:
+        results = executor.map(
+            _parse_file_entities,
+            [temp_dir] * len(filenames), filenames, [input_cache] * len(filenames),
+            chunksize=max(1, len(filenames) // (jobs * 4)))
 
-    hh_edge.postprocess(edges)
-    hh_node.postprocess(nodes, edges.entities)
-    hh_view.postprocess(views, nodes.entities, edges.entities)
+        # merge in the order of inputs to keep results deterministic
+        for filename, (file_nodes, file_edges, file_views) in zip(filenames, results):
+            print(f'Processing {filename}')
+            nodes.merge(file_nodes, 'node')
+            edges.merge(file_edges, 'edge')
+            views.merge(file_views, 'view')
+
+
+def _parse_style(temp_dir, bundled_styles, name, nodes, edges, views, input_cache=None):
+    path = bundled_styles.get_path(name)
+    if path is not None:
+        _parse_file(temp_dir, path, nodes, edges, views, input_cache)
+    else:
+        print(f'Processing style {name}')
+        _parse_data(bundled_styles.load(name), nodes, edges, views)
+
+
+def _get_missing(nodes, edges, views):
+    """Get (kind, id) tuples of referenced entities that are not defined yet."""
+    missing = set()
+    for kind, parsed in [('node', nodes), ('edge', edges), ('view', views)]:
+        for key in parsed.must_exist:
+            if key not in parsed.entities:
+                missing.add((kind, key))
+    return missing
+
+
+def parse(temp_dir, filenames, resource_dirs=None, style_registry=None, input_cache=None, jobs=1):
+    nodes = ParsedEntities()
+    edges = ParsedEntities()
+    views = ParsedEntities()
+
+    if jobs > 1 and len(filenames) > 1:
+        _parse_files_parallel(temp_dir, filenames, nodes, edges, views, input_cache, jobs)
+    else:
+        for filename in filenames:
+            _parse_file(temp_dir, filename, nodes, edges, views, input_cache)
+
+    input_node_keys = set(nodes.entities)
+    input_edge_keys = set(edges.entities)
+
+    style_ancestors = {'node': {}, 'edge': {}}
+    if style_registry is not None:
+        # styles may refer to each other, so keep loading them until all
+        # references are resolved or cannot be resolved
+        loaded = set()
+        while True:
+            style_names = [
+                name for name in style_registry.lookup(_get_missing(nodes, edges, views))
+                if name not in loaded
+            ]
+            if not style_names:
+                break
+            for name in style_names:
+                loaded.add(name)
+                _parse_style(temp_dir, style_registry.bundled_styles, name, nodes, edges, views, input_cache)
+        style_ancestors = style_registry.get_ancestors(loaded)
+
+    edge_style_tags = hh_edge.postprocess(edges, style_ancestors['edge'])
+    node_style_tags = hh_node.postprocess(nodes, edges.entities, style_ancestors['node'])
+    hh_view.postprocess(views, nodes.entities, edges.entities, node_style_tags, edge_style_tags,
+                        nodes.entities.keys() - input_node_keys, edges.entities.keys() - input_edge_keys)
 
     return nodes.entities, views.entities, resource_dirs
 
@@ -97,7 +205,7 @@ def main():
 
     parser.add_argument('inputs', metavar='<filename>', type=str, nargs='*', help='Input files')
     parser.add_argument('-o', '--output', required=False, default='./', help='Output directory [./]')
-    parser.add_argument('-f', '--format', required=False, default='svg', help='Output format [SVG]')
+    parser.add_argument('-f', '--format', required=False, default='svg', help='Output format, multiple comma separated formats are produced from a single layout [SVG]')
     parser.add_argument('-t', '--temp-dir', required=False, default=None, help='Temporary files output directory (defaults to output directory)')
     parser.add_argument('-r', '--resource-dirs', required=False, default=[], action='append',
                         help='Directories to search for graphical resources (can be specified multiple times)')
@@ -107,6 +215,27 @@ def main():
                         help='List installed styles')
     parser.add_argument('-s', '--styles', required=False, default=[], action='append',
                         help='Style names or patterns to include (can be specified multiple times, supports wildcards)')
+    parser.add_argument('-c', '--cache', required=False, action='store_true', default=False,
+                        help='Cache loaded input files in $XDG_CACHE_HOME/hiearch or the directory given by --cache-dir')
+    parser.add_argument('--cache-dir', required=False, default=None,
+                        help='Directory for caching of loaded input files, enables the cache')
+    parser.add_argument('--cache-size', required=False, default=64, type=int,
+                        help='Maximal size of the input cache in MiB [64]')
+    parser.add_argument('--incremental', required=False, action='store_true', default=False,
+                        help='Skip rendering of views with unchanged DOT output, uses a manifest in the output directory')
+    parser.add_argument('--render-cache', required=False, default=None,
+                        help='Directory for caching of rendered views, can be shared by multiple projects')
+    parser.add_argument('--render-cache-size', required=False, default=1024, type=int,
+                        help='Maximal size of the render cache in MiB [1024]')
+    parser.add_argument('-j', '--jobs', required=False, default=1, type=int,
+                        help='Number of parallel jobs, 0 to use all CPUs [1]')
+    parser.add_argument('--resource-mode', required=False, default='copy', choices=util.RESOURCE_MODES,
+                        help='Method of placing resources to temporary and output directories, '
+                        '"update" copies only files with different modification time or size [copy]')
+    parser.add_argument('--hash-resources', required=False, action='store_true', default=False,
+                        help='Name resources by hashes of their contents to avoid name collisions and duplicates')
+    parser.add_argument('--keep-dot', required=False, action='store_true', default=False,
+                        help='Write generated DOT files to the temporary directory')
 
     args = parser.parse_args()
 
@@ -117,13 +246,12 @@ def main():
         install_skill(skill_dir)
         return
 
-    styles_root = importlib_resources.files('hiearch.data.styles')
+    bundled_styles = styles.BundledStyles(importlib_resources.files('hiearch.data.styles'), util.get_version())
 
     # Handle --list-styles option
     if args.list_styles:
-        for yaml_file in sorted(styles_root.iterdir()):
-            if yaml_file.suffix == '.yaml':
-                print(yaml_file.name[:-5])
+        for style_name in bundled_styles.names:
+            print(style_name)
         return
 
     # Require input files for normal operation
@@ -131,28 +259,14 @@ def main():
         parser.error('the following arguments are required: <filename>')
 
     # Build a map of base styles to their variants
-    style_variants = {}
-    for yaml_file in sorted(styles_root.iterdir()):
-        if yaml_file.suffix == '.yaml':
-            style_name = yaml_file.name[:-5]
-            if '-' in style_name:
-                # Style has base-variant format
-                base_name = style_name.split('-', 1)[0]
-                if base_name not in style_variants:
-                    style_variants[base_name] = []
-                style_variants[base_name].append((style_name, str(yaml_file)))
-            else:
-                # Style without variant (no dash)
-                style_variants[style_name] = [(style_name, str(yaml_file))]
+    style_variants = styles.get_style_variants(bundled_styles.names)
 
     if args.styles:
         # Use provided style patterns
         patterns = [p for pattern_list in args.styles for p in pattern_list.split(',')]
+        selected_styles = []
         selected_variants = set()
-        for yaml_file in sorted(styles_root.iterdir()):
-            if yaml_file.suffix != '.yaml':
-                continue
-            style_name = yaml_file.name[:-5]
+        for style_name in bundled_styles.names:
             if any(fnmatch.fnmatch(style_name, pattern) for pattern in patterns):
                 if '-' in style_name:
                     base_name = style_name.split('-', 1)[0]
@@ -160,28 +274,52 @@ def main():
                         print(f'Error: Conflicting style variants selected for base style "{base_name}"', file=sys.stderr)
                         sys.exit(1)
                     selected_variants.add(base_name)
-                args.inputs.append(str(yaml_file))
+                selected_styles.append(style_name)
+        style_registry = styles.StyleRegistry(bundled_styles, selected_styles, on_demand=False)
     else:
-        # Include first variant of each base style by default
-        for base_name in sorted(style_variants.keys()):
-            variants = style_variants[base_name]
-            # First variant in sorted list
-            args.inputs.append(variants[0][1])
+        # Make first variant of each base style available by default, styles
+        # are loaded only if their entities are referenced
+        style_registry = styles.StyleRegistry(
+            bundled_styles, [variants[0] for variants in style_variants.values()])
 
     # Use temporary directory if specified, otherwise use output directory
     temp_dir = args.temp_dir if args.temp_dir is not None else args.output
 
-    nodes, views, resource_dirs = parse(temp_dir, args.inputs, args.resource_dirs)
+    jobs = args.jobs if args.jobs > 0 else os.cpu_count()
+
+    input_cache = None
+    if args.cache or args.cache_dir is not None:
+        cache_dir = args.cache_dir if args.cache_dir is not None else cache.get_default_cache_dir()
+        input_cache = cache.InputCache(cache_dir, args.cache_size * 1024 * 1024)
+
+    nodes, views, resource_dirs = parse(temp_dir, args.inputs, args.resource_dirs, style_registry, input_cache, jobs)
 
-    copied_resources = set()
+    render_cache = None
+    if args.render_cache is not None:
+        render_cache = cache.RenderCache(args.render_cache, args.render_cache_size * 1024 * 1024)
+
+    output_config = graphviz_output.OutputConfig(
+        args.output, temp_dir, args.format, args.incremental, render_cache, args.keep_dot)
+    resource_store = output.ResourceStore(resource_dirs, args.resource_mode, args.hash_resources)
+    render_tasks = []
     for view in views.values():
         if len(view['nodes']) > 0:
-            # Resolve and copy resources from selected nodes before generating views
-            copied_resources = output.resolve_resources(view['nodes'], nodes, temp_dir, resource_dirs, copied_resources)
+            view_nodes = hh_view.get_nodes(view, nodes)
 
-            graphviz_output.generate(
-                graphviz_output.OutputConfig(args.output, temp_dir, args.format),
-                view, nodes, copied_resources)
+            # Resolve and copy resources from selected nodes before generating views
+            output.resolve_resources(view['nodes'], view_nodes, temp_dir, resource_store)
+
+            dot_text, dot_hash = graphviz_output.write_dot(output_config, view, view_nodes, resource_store)
+            view_resources = None
+            if render_cache is not None:
+                view_resources = output.get_resources(view['nodes'], view_nodes)
+            render_tasks.append(graphviz_output.RenderTask(view, dot_text, dot_hash, view_resources))
+
+    failures = graphviz_output.render_views(output_config, render_tasks, jobs)
+    if failures:
+        for view_id in sorted(failures.keys()):
+            print(f'Error: Failed to render view "{view_id}": {failures[view_id]}', file=sys.stderr)
+        sys.exit(1)
 
 
 if __name__ == "__main__":
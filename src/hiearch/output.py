@@ -1,44 +1,127 @@
 """Module for handling generic output tasks such as resource resolution and copying."""
 
+import hashlib
 import os
 
 from . import util
 
 
-def resolve_resource_path(resource_path, resource_dirs, temp_dir, copied_resources):
-    if resource_path in copied_resources:
-        return resource_path
+class ResourceStore:
+    """Resources referenced by nodes and their copies in destination directories.
 
-    relative_path = None
+    Resources are looked up using cached listings of directories, so that
+    each directory is read only once per run. Each resource is copied or
+    linked to a destination directory only once.
 
-    if os.path.exists(resource_path):
-        relative_path = util.copy_resource(resource_path, temp_dir)
+    Resources are named by their base names or, optionally, by hashes of their
+    contents, which avoids collisions of different resources with the same
+    name and duplication of identical resources.
+    """
 
-    if resource_dirs:
-        for resource_dir in resource_dirs:
+    def __init__(self, resource_dirs=None, mode='copy', hash_names=False):
+        self.resource_dirs = resource_dirs if resource_dirs is not None else []
+        self.mode = mode
+        self.hash_names = hash_names
+        # source path -> relative path
+        self.names = {}
+        # directory -> set of entries
+        self.listings = {}
+        # relative path -> source path
+        self.sources = {}
+        # destination path -> source path
+        self.staged = {}
+
+    def _exists(self, path):
+        directory, name = os.path.split(path)
+        if directory not in self.listings:
+            try:
+                self.listings[directory] = set(os.listdir(directory if directory else '.'))
+            except OSError:
+                self.listings[directory] = set()
+        return name in self.listings[directory]
+
+    def find(self, resource_path):
+        """Find resource in the current directory and resource directories, the last match takes precedence."""
+        source_path = None
+
+        if self._exists(resource_path):
+            source_path = resource_path
+
+        for resource_dir in self.resource_dirs:
             full_path = os.path.join(resource_dir, resource_path)
-            if os.path.exists(full_path):
-                relative_path = util.copy_resource(full_path, temp_dir)
+            if self._exists(full_path):
+                source_path = full_path
 
-    if relative_path is not None:
-        copied_resources.add(relative_path)
-        return relative_path
+        if source_path is None:
+            raise RuntimeError(f'Resource not found: {resource_path}')
+        return source_path
+
+    def stage(self, relative_path, dest_dir):
+        """Copy or link resource to the destination directory unless this is already done.
+
+        Returns:
+            True if the resource has been copied or linked
+        """
+        source_path = self.sources[relative_path]
+        dest_path = os.path.abspath(os.path.join(dest_dir, relative_path))
+        if self.staged.get(dest_path) == source_path:
+            return False
+        util.copy_resource(source_path, dest_dir, self.mode, relative_path)
+        self.staged[dest_path] = source_path
+        return True
+
+    def _get_name(self, source_path):
+        if source_path not in self.names:
+            if self.hash_names:
+                with open(source_path, 'rb') as file:
+                    digest = hashlib.sha256(file.read()).hexdigest()
+                # extension is preserved since graphviz uses it to detect image format
+                self.names[source_path] = digest[:20] + os.path.splitext(source_path)[1]
+            else:
+                self.names[source_path] = os.path.basename(source_path)
+        return self.names[source_path]
+
+    def resolve(self, resource_path, temp_dir):
+        """Stage resource to the temporary directory.
 
-    raise RuntimeError(f'Resource not found: {resource_path}')
+        Returns:
+            Path of the resource relative to the temporary directory
+        """
+        if resource_path in self.sources:
+            return resource_path
+
+        source_path = self.find(resource_path)
+        relative_path = self._get_name(source_path)
+        if not self.hash_names or relative_path not in self.sources:
+            # the last found resource with the same base name takes precedence
+            self.sources[relative_path] = source_path
+        self.stage(relative_path, temp_dir)
+        return relative_path
 
 
-def resolve_resources(node_ids, nodes, temp_dir, resource_dirs, copied_resources):
+def resolve_resources(node_ids, nodes, temp_dir, resource_store):
     for node_id in node_ids:
         node = nodes[node_id]
         substitutions = node.get('substitutions', {})
 
         for subst_key, subst_value in substitutions.items():
             if subst_key.startswith("resource_"):
-                relative_path = resolve_resource_path(subst_value, resource_dirs, temp_dir, copied_resources)
-                node['substitutions'][subst_key] = relative_path
+                node['substitutions'][subst_key] = resource_store.resolve(subst_value, temp_dir)
+
+        if 'graphviz' in node and 'image' in node['graphviz']:
+            node['graphviz']['image'] = resource_store.resolve(node['graphviz']['image'], temp_dir)
+
+
+def get_resources(node_ids, nodes):
+    """Get resources referenced by nodes, must be called after resolve_resources()."""
+    resources = set()
+    for node_id in node_ids:
+        node = nodes[node_id]
+        for subst_key, subst_value in node.get('substitutions', {}).items():
+            if subst_key.startswith("resource_"):
+                resources.add(subst_value)
 
         if 'graphviz' in node and 'image' in node['graphviz']:
-            relative_path = resolve_resource_path(node['graphviz']['image'], resource_dirs, temp_dir, copied_resources)
-            node['graphviz']['image'] = relative_path
+            resources.add(node['graphviz']['image'])
 
-    return copied_resources
+    return resources
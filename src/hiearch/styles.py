@@ -0,0 +1,283 @@
+"""Bundled styles: precompiled style pack and registry of styles loaded on demand.
+
+This module must not depend on other hiearch modules since it is also used
+at build time to compile the style pack.
+"""
+
+import os
+import pickle
+
+import yaml
+
+
+PACK_NAME = 'styles.pack'
+
+_SECTION_KINDS = {
+    'nodes': 'node',
+    'edges': 'edge',
+    'views': 'view',
+}
+
+
+def _get_entity_id(kind, key, value):
+    if 'edge' == kind:
+        if 'link' != key:
+            return None
+        if len(value) > 2:
+            return value[2]
+        return f'{value[0]}.{value[1]}'
+
+    if 'id' != key:
+        return None
+    if isinstance(value, list):
+        return value[1]
+    return value
+
+
+def _get_style_key(style):
+    if isinstance(style, list):
+        return f'{style[0]}.{style[1]}'
+    return style
+
+
+def _get_entities(data, kind):
+    entities = {}
+    for entity in data.get(kind + 's', None) or []:
+        key = 'link' if 'edge' == kind else 'id'
+        entities[_get_entity_id(kind, key, entity[key])] = entity
+    return entities
+
+
+def _get_definitions(data):
+    definitions = set()
+    for kind in _SECTION_KINDS.values():
+        definitions.update((kind, key) for key in _get_entities(data, kind))
+    return frozenset(definitions)
+
+
+def _load_style_file(filename):
+    with open(filename, encoding='utf-8') as file:
+        return yaml.load(file, Loader=yaml.SafeLoader) or {}
+
+
+def index_style_file(filename):
+    """Collect ids of entities defined in a style file.
+
+    Returns:
+        Set of (kind, id) tuples, where kind is 'node', 'edge', or 'view'
+    """
+    return _get_definitions(_load_style_file(filename))
+
+
+def get_style_variants(names):
+    """Group style names by base style, variants are named as `<base>-<variant>`.
+
+    Returns:
+        Dictionary mapping base style names to sorted lists of style names
+    """
+    style_variants = {}
+    for style_name in sorted(names):
+        base_name = style_name.split('-', 1)[0]
+        style_variants.setdefault(base_name, []).append(style_name)
+    return style_variants
+
+
+def _collect_pack_ancestors(entities):
+    """Compute style ancestors of entities following the rules of `util.apply_styles()`.
+
+    Entities using `style_notag` inherit the `style` attribute of their style
+    parent, which is then followed by `util.apply_styles()`.
+    Entities with ancestors outside of the given set are skipped.
+    """
+    effective_styles = {}
+
+    def get_effective_style(key, visiting):
+        if key in effective_styles:
+            return effective_styles[key]
+        if key not in entities or key in visiting:
+            raise KeyError(key)
+        visiting.add(key)
+        entity = entities[key]
+        if entity.get('style') is not None:
+            result = _get_style_key(entity['style'])
+        elif entity.get('style_notag') is not None:
+            result = get_effective_style(_get_style_key(entity['style_notag']), visiting)
+        else:
+            result = None
+        effective_styles[key] = result
+        return result
+
+    ancestors = {}
+    for key in entities:
+        visited = set()
+        current = key
+        try:
+            while current is not None and current not in visited:
+                visited.add(current)
+                current = get_effective_style(current, set())
+        except KeyError:
+            continue
+        ancestors[key] = frozenset(visited)
+    return ancestors
+
+
+def compile_pack(styles_dir, version):
+    """Compile YAML style files into a style pack.
+
+    Pack contains pickled data of each style, ids of entities defined by each
+    style, and precomputed style ancestors of nodes and edges. Ancestors are
+    stored only if they do not depend on selection of style variants.
+
+    Args:
+        styles_dir: directory with YAML style files
+        version: hiearch version, pack is ignored by other versions
+
+    Returns:
+        Style pack dictionary
+    """
+    datas = {}
+    for filename in sorted(os.listdir(styles_dir)):
+        if filename.endswith('.yaml'):
+            datas[filename[:-5]] = _load_style_file(os.path.join(styles_dir, filename))
+
+    styles = {}
+    for name, data in datas.items():
+        styles[name] = {
+            'definitions': _get_definitions(data),
+            'data': pickle.dumps(data, protocol=pickle.HIGHEST_PROTOCOL),
+        }
+
+    style_variants = get_style_variants(datas.keys())
+    num_selections = max(len(variants) for variants in style_variants.values())
+
+    ancestors = {}
+    for kind in ['node', 'edge']:
+        selection_ancestors = []
+        for index in range(num_selections):
+            entities = {}
+            for variants in style_variants.values():
+                entities.update(_get_entities(datas[variants[min(index, len(variants) - 1)]], kind))
+            selection_ancestors.append(_collect_pack_ancestors(entities))
+
+        ancestors[kind] = {
+            key: value for key, value in selection_ancestors[0].items()
+            if all(other.get(key) == value for other in selection_ancestors[1:])
+        }
+
+    return {
+        'version': version,
+        'styles': styles,
+        'ancestors': ancestors,
+    }
+
+
+def write_pack(path, pack):
+    with open(path, 'wb') as file:
+        pickle.dump(pack, file, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+class BundledStyles:
+    """Styles distributed with hiearch.
+
+    Styles are taken from the precompiled pack if it is present and matches
+    hiearch version, otherwise YAML style files are used directly. YAML data
+    parsed for indexing is kept until the style is loaded, so that each file
+    is parsed at most once.
+    """
+
+    def __init__(self, styles_root, version):
+        self.pack = None
+        self.paths = {}
+        self.datas = {}
+
+        pack_file = styles_root / PACK_NAME
+        if pack_file.is_file():
+            with pack_file.open('rb') as file:
+                pack = pickle.load(file)
+            if pack.get('version') == version:
+                self.pack = pack
+
+        if self.pack is not None:
+            self.names = list(self.pack['styles'].keys())
+            self.ancestors = self.pack['ancestors']
+        else:
+            for yaml_file in styles_root.iterdir():
+                if yaml_file.suffix == '.yaml':
+                    self.paths[yaml_file.name[:-5]] = str(yaml_file)
+            self.names = sorted(self.paths.keys())
+            self.ancestors = {'node': {}, 'edge': {}}
+
+    def get_definitions(self, name):
+        if self.pack is not None:
+            return self.pack['styles'][name]['definitions']
+        if name not in self.datas:
+            self.datas[name] = _load_style_file(self.paths[name])
+        return _get_definitions(self.datas[name])
+
+    def get_path(self, name):
+        """Get path to YAML style file or None if style data is loaded from
+        the pack or is already parsed."""
+        if name in self.datas:
+            return None
+        return self.paths.get(name)
+
+    def load(self, name):
+        """Load style data from the pack or take parsed data, which may be
+        modified by the caller."""
+        if self.pack is not None:
+            return pickle.loads(self.pack['styles'][name]['data'])
+        return self.datas.pop(name)
+
+
+class StyleRegistry:
+    """Index of style entity ids mapped to bundled styles defining them.
+
+    Styles are loaded on demand by default, i.e., only if entities defined in
+    them are referenced; otherwise all registered styles are loaded.
+    """
+
+    def __init__(self, bundled_styles, names, on_demand=True):
+        self.bundled_styles = bundled_styles
+        self.names = list(names)
+        self.on_demand = on_demand
+        self.definitions = {}
+        if self.on_demand:
+            for name in self.names:
+                for definition in self.bundled_styles.get_definitions(name):
+                    # first registered style takes precedence, duplicates are
+                    # reported by the parser if both styles end up being loaded
+                    self.definitions.setdefault(definition, name)
+
+    def lookup(self, missing):
+        """Get styles defining any of the missing (kind, id) tuples.
+
+        Returns:
+            List of style names in registration order
+        """
+        if not self.on_demand:
+            return self.names
+        required = {self.definitions[key] for key in missing if key in self.definitions}
+        return [name for name in self.names if name in required]
+
+    def get_ancestors(self, loaded_names):
+        """Get precomputed style ancestors that are valid for the given set of loaded styles.
+
+        Returns:
+            Dictionary mapping entity kinds ('node', 'edge') to dictionaries
+            of style ancestor sets
+        """
+        if self.bundled_styles.pack is None:
+            return {'node': {}, 'edge': {}}
+
+        loaded = {'node': set(), 'edge': set(), 'view': set()}
+        for name in loaded_names:
+            for kind, key in self.bundled_styles.get_definitions(name):
+                loaded[kind].add(key)
+
+        result = {}
+        for kind, ancestors in self.bundled_styles.ancestors.items():
+            result[kind] = {
+                key: value for key, value in ancestors.items()
+                if key in loaded[kind] and value <= loaded[kind]
+            }
+        return result
@@ -0,0 +1,114 @@
+"""Boolean tag expressions used for selection of view nodes and edges.
+
+Expressions combine tags with `!` (not), `&` (and), and `|` (or) operators
+in order of decreasing precedence, parentheses can be used for grouping,
+e.g., `hh:scope:backend & !deprecated | critical`. An expression without
+operators is a single tag. Tags containing operator characters must be
+quoted, e.g., `"a|b" & c`.
+
+Expressions are compiled to functions, which are evaluated over bitsets of
+entity indices: `query(get_bits, universe)`, where `get_bits(tag)` returns
+bitset of entities with the given tag and `universe` is bitset of all
+entities.
+"""
+
+import functools
+import re
+
+
+OPERATORS = ('!', '&', '|', '(', ')')
+
+_SPLIT_PATTERN = re.compile(r'("[^"]*"|[!&|()])')
+
+
+def _tag(tag):
+    return lambda get_bits, universe: get_bits(tag)
+
+
+def _not(operand):
+    return lambda get_bits, universe: universe & ~operand(get_bits, universe)
+
+
+def _and(left, right):
+    return lambda get_bits, universe: left(get_bits, universe) & right(get_bits, universe)
+
+
+def _or(left, right):
+    return lambda get_bits, universe: left(get_bits, universe) | right(get_bits, universe)
+
+
+class _Parser:
+    def __init__(self, expression):
+        self.expression = expression
+        self.tokens = [token.strip() for token in _SPLIT_PATTERN.split(expression) if token.strip()]
+        self.position = 0
+        for token in self.tokens:
+            if '"' in token and not self.is_quoted(token):
+                self.error(f'unterminated quote in "{token}"')
+
+    @staticmethod
+    def is_quoted(token):
+        return len(token) > 1 and token.startswith('"') and token.endswith('"')
+
+    def error(self, message):
+        raise RuntimeError(f'Invalid tag expression: "{self.expression}", {message}')
+
+    def peek(self):
+        if self.position < len(self.tokens):
+            return self.tokens[self.position]
+        return None
+
+    def take(self):
+        token = self.peek()
+        if token is None:
+            self.error('unexpected end of expression')
+        self.position += 1
+        return token
+
+    def parse(self):
+        if len(self.tokens) == 0:
+            self.error('expression is empty')
+        query = self.parse_or()
+        if self.peek() is not None:
+            self.error(f'unexpected "{self.peek()}"')
+        return query
+
+    def parse_or(self):
+        query = self.parse_and()
+        while self.peek() == '|':
+            self.take()
+            query = _or(query, self.parse_and())
+        return query
+
+    def parse_and(self):
+        query = self.parse_not()
+        while self.peek() == '&':
+            self.take()
+            query = _and(query, self.parse_not())
+        return query
+
+    def parse_not(self):
+        if self.peek() == '!':
+            self.take()
+            return _not(self.parse_not())
+        return self.parse_operand()
+
+    def parse_operand(self):
+        token = self.take()
+        if token == '(':
+            query = self.parse_or()
+            if self.peek() != ')':
+                self.error('missing ")"')
+            self.take()
+            return query
+        if token in OPERATORS:
+            self.error(f'unexpected "{token}"')
+        if self.is_quoted(token):
+            return _tag(token[1:-1])
+        return _tag(token)
+
+
+@functools.lru_cache(maxsize=None)
+def compile_query(expression):
+    """Compile tag expression, raises RuntimeError if the expression is invalid."""
+    return _Parser(expression).parse()
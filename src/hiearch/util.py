@@ -1,15 +1,78 @@
 """Utility functions for hiearch package."""
 
+import collections
+import collections.abc
 import copy
 import hashlib
+import importlib.metadata
+import keyword
 import os
 import shutil
 
 
-def copy_resource(resource_path, dest_dir):
-    relative_path = os.path.basename(resource_path)
+def get_version():
+    try:
+        return importlib.metadata.version('hiearch')
+    except importlib.metadata.PackageNotFoundError:
+        return 'unknown'
+
+
+RESOURCE_MODES = ['copy', 'update', 'hardlink', 'symlink']
+
+
+def _is_unchanged(resource_path, dest_path):
+    try:
+        source_stat = os.stat(resource_path)
+        dest_stat = os.stat(dest_path)
+    except OSError:
+        return False
+    # copy2() preserves modification time, which is compared with a second
+    # precision since it may be truncated by some file systems
+    return source_stat.st_size == dest_stat.st_size and int(source_stat.st_mtime) == int(dest_stat.st_mtime)
+
+
+def copy_resource(resource_path, dest_dir, mode='copy', relative_path=None):
+    """Copy or link resource to the destination directory.
+
+    Args:
+        resource_path: path to the resource file
+        dest_dir: destination directory
+        mode: 'copy', 'update' to copy only if modification time or size
+            differ, 'hardlink', or 'symlink'; links fall back to copying if
+            they cannot be created, e.g., across file systems
+        relative_path: destination file name, defaults to the resource base name
+
+    Returns:
+        Path of the resource relative to the destination directory
+    """
+    if relative_path is None:
+        relative_path = os.path.basename(resource_path)
     dest_path = os.path.join(dest_dir, relative_path)
     os.makedirs(dest_dir, exist_ok=True)
+
+    if os.path.islink(dest_path) and ('symlink' != mode or not os.path.exists(dest_path)):
+        # avoid writing through links created by previous runs
+        os.remove(dest_path)
+
+    if os.path.exists(dest_path):
+        # links created by previous runs or resources found in the destination directory
+        if os.path.samefile(resource_path, dest_path):
+            return relative_path
+        if 'update' == mode and _is_unchanged(resource_path, dest_path):
+            return relative_path
+        if mode in ('hardlink', 'symlink'):
+            os.remove(dest_path)
+
+    if mode in ('hardlink', 'symlink'):
+        try:
+            if 'hardlink' == mode:
+                os.link(resource_path, dest_path)
+            else:
+                os.symlink(os.path.abspath(resource_path), dest_path)
+            return relative_path
+        except OSError:
+            pass
+
     shutil.copy2(resource_path, dest_path)
     return relative_path
 
@@ -59,20 +122,176 @@ def process_auto_colors(attrs, seed_data):
     return attrs
 
 
-def merge_dict_by_key(secondary, primary, key):
+class Entity(collections.abc.MutableMapping):
+    """Base class of nodes, edges, and views: slotted records with a
+    dictionary interface, so that they can be used in place of dictionaries
+    loaded from YAML and in string formatting.
+
+    Subclasses declare common keys in `__slots__`, keys that are Python
+    keywords are stored in slots with a trailing underscore, e.g., `in_`.
+    Other keys are kept in an extra dictionary, which is created on demand.
+    Missing keys correspond to unset slots.
+
+    The dictionary interface is slower than attribute access, which should
+    be preferred in loops over entities once they are converted from
+    dictionaries, e.g., `node.scope` or `edge.in_`.
+    """
+
+    __slots__ = ('_extra',)
+
+    # key -> slot
+    _key_slots = {}
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls._key_slots = {}
+        for slot in cls.__slots__:
+            key = slot[:-1] if slot.endswith('_') and keyword.iskeyword(slot[:-1]) else slot
+            cls._key_slots[key] = slot
+
+    def __init__(self, data=None):
+        self._extra = None
+        if data is not None:
+            for key, value in data.items():
+                self[key] = value
+
+    def __getitem__(self, key):
+        slot = self._key_slots.get(key)
+        if slot is not None:
+            try:
+                return getattr(self, slot)
+            except AttributeError:
+                raise KeyError(key) from None
+        if self._extra is None:
+            raise KeyError(key)
+        return self._extra[key]
+
+    def get(self, key, default=None):
+        slot = self._key_slots.get(key)
+        if slot is not None:
+            return getattr(self, slot, default)
+        if self._extra is None:
+            return default
+        return self._extra.get(key, default)
+
+    def __setitem__(self, key, value):
+        slot = self._key_slots.get(key)
+        if slot is not None:
+            setattr(self, slot, value)
+        else:
+            if self._extra is None:
+                self._extra = {}
+            self._extra[key] = value
+
+    def __delitem__(self, key):
+        slot = self._key_slots.get(key)
+        if slot is not None:
+            try:
+                delattr(self, slot)
+            except AttributeError:
+                raise KeyError(key) from None
+        elif self._extra is None:
+            raise KeyError(key)
+        else:
+            del self._extra[key]
+
+    def __contains__(self, key):
+        slot = self._key_slots.get(key)
+        if slot is not None:
+            return hasattr(self, slot)
+        return self._extra is not None and key in self._extra
+
+    def __iter__(self):
+        for key, slot in self._key_slots.items():
+            if hasattr(self, slot):
+                yield key
+        if self._extra is not None:
+            yield from self._extra
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def __repr__(self):
+        return f'{type(self).__name__}({dict(self)!r})'
+
+
+class LayeredDict(collections.ChainMap):
+    """Own attributes of an entity layered over attributes inherited from its
+    styles, which are shared and not copied.
+
+    Own attributes may be shared with other entities as well, so they are
+    copied on the first modification.
+    """
+
+    def __init__(self, *maps):
+        super().__init__(*maps)
+        self.owned = False
+
+    def _own(self):
+        if not self.owned:
+            self.maps[0] = dict(self.maps[0])
+            self.owned = True
+        return self.maps[0]
+
+    def __setitem__(self, key, value):
+        self._own()[key] = value
+
+    def __delitem__(self, key):
+        del self._own()[key]
+
+    def pop(self, key, *args):
+        return self._own().pop(key, *args)
+
+    def popitem(self):
+        return self._own().popitem()
+
+    def clear(self):
+        self._own().clear()
+
+    def copy(self):
+        return dict(self)
+
+    def __deepcopy__(self, memo):
+        # copies are independent of styles
+        return copy.deepcopy(dict(self), memo)
+
+
+def intern_dict(attrs, interned):
+    """Get a shared instance of a dictionary with the same items, dictionaries
+    with unhashable values are not interned."""
+    try:
+        key = tuple(attrs.items())
+        return interned.setdefault(key, attrs)
+    except TypeError:
+        return attrs
+
+
+def merge_dict_by_key(secondary, primary, key, interned=None):
     if key in primary:
-        tmp = dict(secondary[key])
-        tmp.update(primary[key])
-        primary[key] = tmp
+        if interned is None:
+            tmp = dict(secondary[key])
+            tmp.update(primary[key])
+            primary[key] = tmp
+        elif len(secondary[key]) > 0:
+            inherited = secondary[key].maps if isinstance(secondary[key], LayeredDict) else [secondary[key]]
+            primary[key] = LayeredDict(intern_dict(primary[key], interned), *inherited)
     else:
         primary[key] = secondary[key]
 
 
-def merge_styles(secondary, primary, with_tags=True, is_view=False):
-    """Merge style attributes from secondary into primary."""
+def merge_styles(secondary, primary, with_tags=True, is_view=False, interned=None):
+    """Merge style attributes from secondary into primary.
+
+    If `interned` dictionary is given, attributes of nodes and edges are
+    layered over the inherited attributes instead of being copied, and
+    identical own attributes of entities are shared.
+    """
+    if is_view:
+        interned = None
+
     if 'graphviz' in secondary:
         if 'substitutions' in secondary:
-            merge_dict_by_key(secondary, primary, 'substitutions')
+            merge_dict_by_key(secondary, primary, 'substitutions', interned)
 
         if is_view:
             # there is an extra nested level in views
@@ -83,7 +302,7 @@ def merge_styles(secondary, primary, with_tags=True, is_view=False):
                     else:
                         primary['graphviz'] = secondary['graphviz']
         else:
-            merge_dict_by_key(secondary, primary, 'graphviz')
+            merge_dict_by_key(secondary, primary, 'graphviz', interned)
 
     result = dict(secondary)
     result.update(primary)
@@ -98,35 +317,85 @@ def merge_styles(secondary, primary, with_tags=True, is_view=False):
     return result
 
 
-def apply_styles(styled_entities, entities, is_view=False):
-    """Apply styles from styled entities to the main entities."""
-    size = len(styled_entities)
-    nodes_style_applied = set()
+def _get_style_parent(entity):
+    if entity.get('style') is not None:
+        return entity['style'], True
+    return entity['style_notag'], False
 
-    while size > 0:
-        index = 0
-        size_copy = copy.deepcopy(size)
-        while index < size:
-            with_tags = True
-            if 'style' in styled_entities[index]:
-                father_entity = entities[styled_entities[index]['style']]
-            else:
-                father_entity = entities[styled_entities[index]['style_notag']]
-                with_tags = False
-
-            is_style_root = ('style' not in father_entity or father_entity['style'] is None) \
-                and ('style_notag' not in father_entity or father_entity['style_notag'] is None)
-
-            if is_style_root or father_entity['id'] in nodes_style_applied:
-                key = styled_entities[index]['id']
-                entities[key] = merge_styles(father_entity, styled_entities[index], with_tags, is_view)
-                nodes_style_applied.add(key)
-                styled_entities[index], styled_entities[size - 1] = styled_entities[size - 1], styled_entities[index]
-                size -= 1
-            else:
-                index += 1
-        if size_copy == size:
-            raise RuntimeError(f'Style cycle detected: {styled_entities[0:size]}')
+
+def _get_style_chain(style, entities, chains, known_ancestors):
+    """Get set of the given style and its style ancestors, style chains of
+    merged entities cannot contain cycles."""
+    path = []
+    current = style
+    while current is not None and current not in chains:
+        if known_ancestors is not None and current in known_ancestors:
+            # precomputed ancestors, e.g., from the style pack
+            chains[current] = frozenset(known_ancestors[current])
+            break
+        path.append(current)
+        current = entities[current].get('style') if current in entities else None
+
+    chain = chains[current] if current is not None else frozenset()
+    for key in reversed(path):
+        chain = chain | {key}
+        chains[key] = chain
+    return chains[style]
+
+
+def apply_styles(styled_entities, entities, is_view=False, known_ancestors=None, entity_type=dict):
+    """Apply styles from styled entities to the main entities.
+
+    Each entity has at most one style, so entities are merged with their
+    styles following style chains from roots, which guarantees that styles
+    are merged before entities using them.
+
+    Merged entities are converted to the given entity type.
+
+    Returns:
+        Dictionary mapping ids of entities with styles to frozen sets of
+        their style ancestors including the style itself
+    """
+    styled = {entity['id']: entity for entity in styled_entities}
+    interned = {}
+    merged = []
+    merged_set = set()
+    failed = set()
+    cycles = []
+
+    for key in styled:
+        # follow style chain until a style root or an already merged entity
+        path = []
+        path_index = {}
+        current = key
+        while current in styled and current not in merged_set and current not in failed and current not in path_index:
+            path_index[current] = len(path)
+            path.append(current)
+            current = _get_style_parent(styled[current])[0]
+
+        if current in path_index:
+            cycles.append(path[path_index[current]:] + [current])
+            failed.update(path)
+        elif current in failed:
+            failed.update(path)
+        else:
+            for path_key in reversed(path):
+                parent, with_tags = _get_style_parent(styled[path_key])
+                entities[path_key] = entity_type(
+                    merge_styles(entities[parent], styled[path_key], with_tags, is_view, interned))
+                merged.append(path_key)
+                merged_set.add(path_key)
+
+    if cycles:
+        raise RuntimeError('Style cycle detected: ' + '; '.join(' -> '.join(cycle) for cycle in cycles))
+
+    chains = {}
+    ancestors = {}
+    for key in merged:
+        style = entities[key].get('style')
+        if style is not None:
+            ancestors[key] = _get_style_chain(style, entities, chains, known_ancestors)
+    return ancestors
 
 
 def check_key_existence(keys, dictionary, data_type):
@@ -142,16 +411,3 @@ def ensure_set(value):
     if isinstance(value, list):
         return set(value)
     return {value}
-
-
-def collect_style_ancestors(style, entities):
-    visited = set()
-    current = style
-    while current is not None and current not in visited:
-        visited.add(current)
-        if current in entities:
-            current = entities[current].get('style')
-        else:
-            current = None
-    return visited
-